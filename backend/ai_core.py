@@ -1,10 +1,17 @@
 from __future__ import annotations
+import hashlib
+import re
+import threading
+import time
 from typing import List, Dict, Any
+from .cache import LRUCache
 from .config import settings
 
 # Lazy import llama-cpp-python to allow environments without it
 _Llama: Any | None = None
 _llm: Any | None = None
+_llm_lock = threading.Lock()
+_llm_failed_at: float | None = None
 
 SYSTEM_PROMPT = (
     "Anda adalah NEXUS, Pelatih Pribadi HMM. Bantu asesmen kompetensi, susun IDP yang terstruktur, "
@@ -25,25 +32,60 @@ def _ensure_llama_class():
 
 
 def get_llm():
-    """Lazy-load LLM lokal (GGUF via llama-cpp); return None jika tidak tersedia."""
-    global _llm
+    """Lazy-load LLM lokal (GGUF via llama-cpp); return None jika tidak tersedia.
+    Setelah gagal, dicoba ulang paling sering tiap MODEL_RETRY_SECONDS."""
+    global _llm, _llm_failed_at
     if _llm is not None:
         return _llm
-    LlamaClass = _ensure_llama_class()
-    if LlamaClass is None:
+    if _llm_failed_at is not None and time.monotonic() - _llm_failed_at < settings.MODEL_RETRY_SECONDS:
         return None
-    try:
-        _llm = LlamaClass(
-            model_path=settings.MODEL_GGUF_PATH,
-            n_ctx=settings.LLM_CONTEXT,
-            n_threads=settings.LLM_THREADS,
-            verbose=False,
-        )
-    except Exception:
-        _llm = None
+    with _llm_lock:
+        if _llm is not None:
+            return _llm
+        LlamaClass = _ensure_llama_class()
+        if LlamaClass is None:
+            _llm_failed_at = time.monotonic()
+            return None
+        try:
+            _llm = LlamaClass(
+                model_path=settings.MODEL_GGUF_PATH,
+                n_ctx=settings.LLM_CONTEXT,
+                n_threads=settings.LLM_THREADS,
+                verbose=False,
+            )
+            _llm_failed_at = None
+        except Exception:
+            _llm = None
+            _llm_failed_at = time.monotonic()
     return _llm
 
 
+# Token counts per text (keyed by digest), for the tokenizer and the estimator alike
+_token_counts = LRUCache(max_items=20000)
+_WORD_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+def estimate_tokens(text: str) -> int:
+    """Tokenizer-free estimate for SentencePiece-style vocabularies: punctuation is one
+    token, words about one token per 4 characters (Indonesian words split more often
+    than English ones, so this errs on the high side)."""
+    return sum((len(w) + 3) // 4 for w in _WORD_RE.findall(text))
+
+
+def count_tokens(text: str) -> tuple[int, bool]:
+    """(tokens, exact): the loaded model's tokenizer when available, else the estimate."""
+    llm = get_llm()
+    key = (llm is not None, hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest())
+    n = _token_counts.get(key)
+    if n is None:
+        if llm is not None:
+            n = len(llm.tokenize(text.encode("utf-8"), add_bos=False))
+        else:
+            n = estimate_tokens(text)
+        _token_counts.put(key, n)
+    return n, llm is not None
+
+
 def _format_prompt(messages: List[Dict[str, str]]) -> str:
     """Gabungkan pesan menjadi prompt instruksi generik."""
     system = SYSTEM_PROMPT
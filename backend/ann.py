@@ -0,0 +1,221 @@
+from __future__ import annotations
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Tuple
+import numpy as np
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+class IVFIndex:
+    """Inverted-file ANN index in pure NumPy (spherical k-means over normalized rows).
+
+    Rows are referenced by position in the caller's matrix, so the index stores no
+    vectors of its own: only centroids and a per-row list assignment. The posting
+    lists are rebuilt (one stable argsort) lazily after incremental adds.
+    """
+
+    kind = "ivf"
+
+    def __init__(self, nlist: int, nprobe: int, iters: int = 10, sample: int = 50000, seed: int = 42) -> None:
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.iters = iters
+        self.sample = sample
+        self.seed = seed
+        self.centroids: np.ndarray | None = None
+        self._assign = np.empty(0, dtype=np.int32)
+        # (order, offsets) swapped in as one tuple so concurrent readers never pair an
+        # order from one rebuild with offsets from another
+        self._postings: Tuple[np.ndarray, np.ndarray] = (np.empty(0, dtype=np.int64), np.zeros(1, dtype=np.int64))
+        self._dirty = False
+
+    @property
+    def ntotal(self) -> int:
+        return int(self._assign.shape[0])
+
+    def train(self, matrix: np.ndarray) -> None:
+        rng = np.random.default_rng(self.seed)
+        n = matrix.shape[0]
+        nlist = max(1, min(self.nlist, n))
+        pick = rng.choice(n, size=min(n, max(self.sample, nlist)), replace=False)
+        x = np.asarray(matrix[np.sort(pick)], dtype=np.float32)
+        cent = x[rng.choice(x.shape[0], size=nlist, replace=False)].copy()
+        for _ in range(self.iters):
+            assign = np.argmax(x @ cent.T, axis=1)
+            counts = np.bincount(assign, minlength=nlist)
+            order = np.argsort(assign, kind="stable")
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            empty = counts == 0
+            sums = np.zeros_like(cent)
+            sums[~empty] = np.add.reduceat(x[order], starts[~empty], axis=0)
+            if empty.any():
+                # re-seed empty cells with random points so no list stays unused
+                sums[empty] = x[rng.choice(x.shape[0], size=int(empty.sum()), replace=False)]
+            cent = sums / (np.linalg.norm(sums, axis=1, keepdims=True) + 1e-9)
+        self.centroids = cent.astype(np.float32)
+        self.nlist = nlist
+
+    def add(self, vectors: np.ndarray, block: int = 65536) -> None:
+        """Assign rows [ntotal, ntotal + len(vectors)) to their nearest centroid."""
+        parts = [self._assign]
+        for s in range(0, vectors.shape[0], block):
+            blk = np.asarray(vectors[s : s + block], dtype=np.float32)
+            parts.append(np.argmax(blk @ self.centroids.T, axis=1).astype(np.int32))
+        self._assign = np.concatenate(parts)
+        self._dirty = True
+
+    def _lists(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._dirty:
+            self._dirty = False
+            assign = self._assign
+            order = np.argsort(assign, kind="stable")
+            counts = np.bincount(assign, minlength=self.nlist)
+            self._postings = (order, np.concatenate([[0], np.cumsum(counts)]).astype(np.int64))
+        return self._postings
+
+    def candidates(self, q: np.ndarray, nprobe: int | None = None) -> np.ndarray:
+        """Row positions in the `nprobe` lists closest to the query."""
+        order, offsets = self._lists()
+        probes = _top_k(self.centroids @ q, nprobe or self.nprobe)
+        if probes.size == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([order[offsets[p] : offsets[p + 1]] for p in probes])
+
+    def search(
+        self, matrix: np.ndarray, q: np.ndarray, k: int, nprobe: int | None = None, size: int | None = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k rows among the probed lists. `size` bounds the rows to those of the
+        caller's snapshot (another thread may already have extended the index)."""
+        rows = self.candidates(q, nprobe)
+        if size is not None:
+            rows = rows[rows < size]
+        if rows.size == 0:
+            return rows, np.empty(0, dtype=np.float32)
+        rows.sort()  # sequential access pattern into the (possibly memory-mapped) matrix
+        scores = matrix[rows] @ q
+        top = _top_k(scores, k)
+        return rows[top], scores[top]
+
+
+class _SharedLock:
+    """Readers-writer lock: any number of shared holders, or one exclusive holder.
+    Waiting writers block new readers, so a steady query load cannot starve adds."""
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def shared(self) -> Iterator[None]:
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class HNSWIndex:
+    """faiss HNSW graph over inner product; labels are row positions.
+
+    faiss does not allow searching while nodes are being inserted, so adds take the
+    lock exclusively; searches only share it and run concurrently (in C++, without
+    the GIL), each with its own efSearch passed as search parameters.
+    """
+
+    kind = "hnsw"
+
+    def __init__(self, dim: int, m: int, ef_search: int, ef_construction: int) -> None:
+        import faiss  # type: ignore
+
+        self._faiss = faiss
+        self._index = faiss.IndexHNSWFlat(dim, m, faiss.METRIC_INNER_PRODUCT)
+        self._index.hnsw.efConstruction = ef_construction
+        self._index.hnsw.efSearch = ef_search
+        self.ef_search = ef_search
+        self._lock = _SharedLock()
+
+    @property
+    def ntotal(self) -> int:
+        return int(self._index.ntotal)
+
+    def train(self, matrix: np.ndarray) -> None:
+        return None
+
+    def add(self, vectors: np.ndarray, block: int = 65536) -> None:
+        for s in range(0, vectors.shape[0], block):
+            blk = np.ascontiguousarray(vectors[s : s + block], dtype=np.float32)
+            with self._lock.exclusive():
+                self._index.add(blk)
+
+    def search(
+        self, matrix: np.ndarray, q: np.ndarray, k: int, ef_search: int | None = None, size: int | None = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k labels; with `size`, labels at or past the caller's snapshot are dropped
+        (over-fetching by the rows added since)."""
+        with self._lock.shared():
+            extra = max(0, self.ntotal - size) if size is not None else 0
+            fetch = k + extra
+            params = self._faiss.SearchParametersHNSW()
+            params.efSearch = max(ef_search or self.ef_search, fetch)
+            scores, labels = self._index.search(q.reshape(1, -1).astype(np.float32), fetch, params=params)
+        keep = labels[0] >= 0
+        if size is not None:
+            keep &= labels[0] < size
+        return labels[0][keep][:k].astype(np.int64), scores[0][keep][:k]
+
+
+def faiss_available() -> bool:
+    try:
+        import faiss  # type: ignore  # noqa: F401
+        return True
+    except Exception:
+        return False
+
+
+def auto_nlist(n: int) -> int:
+    """Rule of thumb for IVF: about 4*sqrt(n) lists."""
+    return max(1, int(4 * np.sqrt(max(n, 1))))
+
+
+def build_ann(mode: str, matrix: np.ndarray, *, nlist: int = 0, nprobe: int = 8, m: int = 32,
+              ef_search: int = 64, ef_construction: int = 80):
+    """Build an ANN structure over `matrix` rows. `mode` is "ivf" or "hnsw" (HNSW falls
+    back to IVF when faiss is not installed)."""
+    n, dim = matrix.shape
+    if mode == "hnsw" and faiss_available():
+        ann = HNSWIndex(dim, m=m, ef_search=ef_search, ef_construction=ef_construction)
+    else:
+        ann = IVFIndex(nlist=nlist or auto_nlist(n), nprobe=nprobe)
+    ann.train(matrix)
+    ann.add(matrix)
+    return ann
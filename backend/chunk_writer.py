@@ -0,0 +1,134 @@
+from __future__ import annotations
+import io
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy import delete, insert, text
+from sqlalchemy.orm import Session
+
+from . import db as dbmod, vector_index
+from .config import settings
+from .db import Chunk, pack_embedding, upsert_documents
+
+
+def _copy_text(value: Any) -> str:
+    """One field in COPY ... FROM STDIN text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "\\\\x" + bytes(value).hex()
+    if isinstance(value, np.ndarray):
+        value = dbmod.pgvector_literal(value)
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+class ChunkWriter:
+    """Bulk chunk replacement shared by the ETL, the dataset ingester and /admin/index.
+
+    replace() deletes a document's chunks and inserts the new ones set-based: an
+    executemany INSERT ... RETURNING in batches of CHUNK_WRITE_BATCH rows, or COPY on
+    Postgres (ids pre-allocated from the sequence). replace() never commits: call
+    checkpoint() between documents to commit once CHUNK_WRITE_BATCH rows are pending,
+    and commit() at the end. The in-process search indexes are notified for every
+    document of a batch after its commit.
+    """
+
+    def __init__(self, db: Session, batch_rows: Optional[int] = None) -> None:
+        self.db = db
+        self.batch_rows = max(1, batch_rows or settings.CHUNK_WRITE_BATCH)
+        self._pending: List[Tuple[int, List[int], np.ndarray, List[str], Optional[str]]] = []
+        self._pending_rows = 0
+        self.rows = 0
+        self.seconds = 0.0
+
+    def _use_copy(self) -> bool:
+        if not (dbmod.IS_POSTGRES and settings.CHUNK_COPY.lower() in ("1", "true", "yes")):
+            return False
+        cursor = self.db.connection().connection.dbapi_connection.cursor()
+        return hasattr(cursor, "copy_expert")
+
+    def _insert(self, rows: List[Dict[str, Any]]) -> List[int]:
+        table = Chunk.__table__
+        stmt = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+        ids: List[int] = []
+        for s in range(0, len(rows), self.batch_rows):
+            ids.extend(self.db.execute(stmt, rows[s : s + self.batch_rows]).scalars().all())
+        return ids
+
+    def _copy(self, rows: List[Dict[str, Any]]) -> List[int]:
+        ids = self.db.execute(
+            text("SELECT nextval(pg_get_serial_sequence('chunks', 'id')) FROM generate_series(1, :n)"),
+            {"n": len(rows)},
+        ).scalars().all()
+        cols = ["id", *rows[0].keys()]
+        buf = io.StringIO()
+        for cid, row in zip(ids, rows):
+            buf.write("\t".join(_copy_text(v) for v in (cid, *row.values())))
+            buf.write("\n")
+        buf.seek(0)
+        cursor = self.db.connection().connection.dbapi_connection.cursor()
+        cursor.copy_expert(f"COPY chunks ({', '.join(cols)}) FROM STDIN", buf)
+        return list(ids)
+
+    def replace(self, document_id: int, pieces: Sequence[str], embeddings: np.ndarray, source: Optional[str] = None) -> List[int]:
+        """Swap the document's chunks for `pieces`; returns the new chunk ids."""
+        t0 = time.perf_counter()
+        embs = np.asarray(embeddings, dtype=np.float32)
+        self.db.execute(delete(Chunk.__table__).where(Chunk.__table__.c.document_id == document_id))
+        rows = [
+            {"document_id": document_id, "chunk_index": idx, "text": txt, **pack_embedding(emb)}
+            for idx, (txt, emb) in enumerate(zip(pieces, embs))
+        ]
+        ids = (self._copy(rows) if self._use_copy() else self._insert(rows)) if rows else []
+        self._pending.append((document_id, ids, embs, list(pieces), source))
+        self._pending_rows += len(rows)
+        self.rows += len(rows)
+        self.seconds += time.perf_counter() - t0
+        return ids
+
+    def write_documents(self, docs: Sequence[Tuple[Dict[str, Any], Sequence[str], np.ndarray]]) -> List[int]:
+        """Upsert a batch of (document fields, pieces, embeddings) with db.upsert_documents
+        and replace each one's chunks; returns the document ids."""
+        ids = upsert_documents(self.db, [fields for fields, _, _ in docs])
+        for doc_id, (fields, pieces, embs) in zip(ids, docs):
+            self.replace(doc_id, pieces, embs, source=fields.get("source"))
+        return ids
+
+    @contextmanager
+    def savepoint(self) -> Iterator[None]:
+        """Writes inside the block are rolled back together (SAVEPOINT) on error, without
+        losing the rest of the pending batch."""
+        mark = (len(self._pending), self._pending_rows, self.rows)
+        try:
+            with self.db.begin_nested():
+                yield
+        except Exception:
+            del self._pending[mark[0] :]
+            self._pending_rows, self.rows = mark[1], mark[2]
+            raise
+
+    def checkpoint(self) -> None:
+        """Commit if a full batch of rows is pending."""
+        if self._pending_rows >= self.batch_rows:
+            self.commit()
+
+    def commit(self) -> None:
+        t0 = time.perf_counter()
+        self.db.commit()
+        self.seconds += time.perf_counter() - t0
+        pending, self._pending, self._pending_rows = self._pending, [], 0
+        for document_id, ids, embs, pieces, source in pending:
+            # keep the in-process search indexes current (no-op when the API isn't in this process)
+            vector_index.on_document_chunks_written(document_id, ids, embs, texts=pieces, source=source)
+
+    def rollback(self) -> None:
+        self.db.rollback()
+        self._pending, self._pending_rows = [], 0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> str:
+        return f"{self.rows} chunks written in {self.seconds:.1f}s ({self.rows_per_second:.0f} rows/s)"
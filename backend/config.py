@@ -19,13 +19,105 @@ class Settings:
     )
     LLM_THREADS: int = int(os.getenv("LLM_THREADS", "2"))
     LLM_CONTEXT: int = int(os.getenv("LLM_CONTEXT", "3072"))
+    # RAG prompt: answer length, and an optional cap (0 = whatever the window leaves) on
+    # retrieved-context tokens; prompt evaluation time grows with every context token
+    RAG_MAX_NEW_TOKENS: int = int(os.getenv("RAG_MAX_NEW_TOKENS", "700"))
+    RAG_CONTEXT_TOKENS: int = int(os.getenv("RAG_CONTEXT_TOKENS", "0"))
 
     # Admin/API settings
     ADMIN_TOKEN: str | None = os.getenv("ADMIN_TOKEN")
     CORS_ORIGINS: str = os.getenv("CORS_ORIGINS", "*")
 
+    # Model loading: warm all configured models in the background at startup; /ready
+    # returns 503 until the READY_REQUIRE models (comma-separated) are loaded. Failed
+    # loads are retried at most every MODEL_RETRY_SECONDS.
+    WARMUP_MODELS: str = os.getenv("WARMUP_MODELS", "1")
+    READY_REQUIRE: str = os.getenv("READY_REQUIRE", "embedding")
+    MODEL_RETRY_SECONDS: float = float(os.getenv("MODEL_RETRY_SECONDS", "60"))
+
     # Reranker settings
     RERANKER_ENABLED: str = os.getenv("RERANKER_ENABLED", "0")
     RERANKER_MODEL: str = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+    RERANK_BATCH_SIZE: int = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+    RERANK_BUDGET_MS: float = float(os.getenv("RERANK_BUDGET_MS", "0"))  # 0 = no budget
+    RERANK_CACHE_SIZE: int = int(os.getenv("RERANK_CACHE_SIZE", "20000"))
+
+    # Query-embedding cache (search queries only; ingestion bypasses it)
+    QUERY_CACHE_SIZE: int = int(os.getenv("QUERY_CACHE_SIZE", "2048"))
+    QUERY_CACHE_TTL: float = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+
+    # Query micro-batching: concurrent query embeds wait up to EMBED_BATCH_WAIT_MS (0 = off)
+    # to share one encode call of at most EMBED_BATCH_MAX_SIZE texts
+    EMBED_BATCH_WAIT_MS: float = float(os.getenv("EMBED_BATCH_WAIT_MS", "3"))
+    EMBED_BATCH_MAX_SIZE: int = int(os.getenv("EMBED_BATCH_MAX_SIZE", "64"))
+
+    # Retrieval mode: "dense" or "hybrid" (BM25 + dense, reciprocal-rank fused)
+    RETRIEVAL_MODE: str = os.getenv("RETRIEVAL_MODE", "dense").lower()
+
+    # Maximal marginal relevance for the final top-k: 1.0 = plain relevance order, lower
+    # values trade relevance for diversity (RAG defaults lower: overlapping chunks waste prompt)
+    MMR_LAMBDA: float = float(os.getenv("MMR_LAMBDA", "1.0"))
+    RAG_MMR_LAMBDA: float = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+
+    # Retrieval result cache (entries are versioned by the index generation)
+    RESULT_CACHE_SIZE: int = int(os.getenv("RESULT_CACHE_SIZE", "4096"))
+    RESULT_CACHE_MAX_BYTES: int = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+    # Vector index: how often (seconds) searches re-check the chunks table for out-of-process writes
+    VECTOR_INDEX_SYNC_SECONDS: float = float(os.getenv("VECTOR_INDEX_SYNC_SECONDS", "5"))
+    # Binary float32 embedding store (memory-mapped by the index); set empty to disable
+    EMBEDDING_STORE_DIR: str = os.getenv("EMBEDDING_STORE_DIR", "data/vectors")
+
+    # Ingestion: documents are coalesced into groups of ~EMBED_BULK_TEXTS texts and encoded
+    # in token-length buckets of EMBED_BULK_BATCH_SIZE
+    EMBED_BULK_TEXTS: int = int(os.getenv("EMBED_BULK_TEXTS", "512"))
+    EMBED_BULK_BATCH_SIZE: int = int(os.getenv("EMBED_BULK_BATCH_SIZE", "64"))
+
+    # Persistent (model, sha256(text)) -> vector cache consulted by ingestion; empty disables
+    EMBEDDING_CACHE_PATH: str = os.getenv("EMBEDDING_CACHE_PATH", "data/embedding_cache.sqlite")
+
+    # First-pass scan over int8 codes ("int8") with float rescoring of the top
+    # k * QUANT_RESCORE_FACTOR rows; pair with EMBEDDING_STORE_DIR so floats stay on disk
+    VECTOR_QUANTIZATION: str = os.getenv("VECTOR_QUANTIZATION", "none").lower()
+    QUANT_RESCORE_FACTOR: int = int(os.getenv("QUANT_RESCORE_FACTOR", "4"))
+
+    # Exact scans over at least SEARCH_SHARD_MIN_ROWS rows are split into SEARCH_SHARDS
+    # row ranges scored in parallel threads (0 = one per CPU, 1 = off); keep BLAS
+    # single-threaded (OPENBLAS_NUM_THREADS=1 etc.) when enabling this
+    SEARCH_SHARDS: int = int(os.getenv("SEARCH_SHARDS", "1"))
+    SEARCH_SHARD_MIN_ROWS: int = int(os.getenv("SEARCH_SHARD_MIN_ROWS", "50000"))
+
+    # SQLite file databases: WAL journal plus these per-connection pragmas (SQLITE_TUNE=0
+    # keeps SQLite's defaults); search endpoints then read through a separate
+    # query_only pool of READ_POOL_SIZE connections that ingestion commits don't block
+    SQLITE_TUNE: str = os.getenv("SQLITE_TUNE", "1")
+    SQLITE_SYNCHRONOUS: str = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+    SQLITE_MMAP_MB: int = int(os.getenv("SQLITE_MMAP_MB", "256"))
+    SQLITE_CACHE_MB: int = int(os.getenv("SQLITE_CACHE_MB", "64"))
+    SQLITE_BUSY_TIMEOUT_MS: int = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    READ_POOL_SIZE: int = int(os.getenv("READ_POOL_SIZE", "8"))
+
+    # Chunk writes (ETL, dataset ingest, /admin/index) go out as executemany INSERTs of
+    # CHUNK_WRITE_BATCH rows and commit once that many rows are pending; CHUNK_COPY=1
+    # uses COPY instead on Postgres (psycopg2)
+    CHUNK_WRITE_BATCH: int = int(os.getenv("CHUNK_WRITE_BATCH", "1000"))
+    CHUNK_COPY: str = os.getenv("CHUNK_COPY", "1")
+
+    # Postgres only: store vectors in a pgvector column too and run the dense search in
+    # SQL (ORDER BY embedding <=> q) instead of the in-process index
+    PGVECTOR: str = os.getenv("PGVECTOR", "0")
+    EMBEDDING_DIM: int = int(os.getenv("EMBEDDING_DIM", "384"))
+    PGVECTOR_INDEX: str = os.getenv("PGVECTOR_INDEX", "hnsw").lower()  # "hnsw" or "ivfflat"
+    PGVECTOR_LISTS: int = int(os.getenv("PGVECTOR_LISTS", "100"))
+    PGVECTOR_PROBES: int = int(os.getenv("PGVECTOR_PROBES", "8"))
+
+    # Approximate search: "exact" (default), "ivf" (pure NumPy) or "hnsw" (faiss, falls back to ivf)
+    VECTOR_SEARCH_MODE: str = os.getenv("VECTOR_SEARCH_MODE", "exact").lower()
+    ANN_MIN_ROWS: int = int(os.getenv("ANN_MIN_ROWS", "20000"))
+    ANN_NLIST: int = int(os.getenv("ANN_NLIST", "0"))  # 0 = auto (~4*sqrt(rows))
+    ANN_NPROBE: int = int(os.getenv("ANN_NPROBE", "8"))
+    HNSW_M: int = int(os.getenv("HNSW_M", "32"))
+    HNSW_EF_SEARCH: int = int(os.getenv("HNSW_EF_SEARCH", "64"))
+    HNSW_EF_CONSTRUCTION: int = int(os.getenv("HNSW_EF_CONSTRUCTION", "80"))
 
 settings = Settings()
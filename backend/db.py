@@ -1,8 +1,14 @@
 from __future__ import annotations
+import logging
 import os
-from typing import Generator
-from sqlalchemy import create_engine, Column, Integer, String, Text, ForeignKey, JSON
+from typing import Any, Dict, Generator, List, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy import (
+    create_engine, event, inspect, and_, or_, select, text, tuple_, update, bindparam,
+    Column, Integer, SmallInteger, String, Text, ForeignKey, JSON, LargeBinary, UniqueConstraint,
+)
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
+from sqlalchemy.types import UserDefinedType
 from sqlalchemy.exc import OperationalError
 try:
     from sqlalchemy.dialects.postgresql import JSONB as PG_JSONB
@@ -10,6 +16,8 @@ except Exception:
     PG_JSONB = None
 from .config import settings
 
+logger = logging.getLogger(__name__)
+
 DATABASE_URL = settings.DATABASE_URL or os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     # Fallback to local SQLite for development
@@ -23,14 +31,77 @@ if DATABASE_URL.startswith("sqlite"):
 
 engine = create_engine(DATABASE_URL, **engine_kwargs)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# File-backed SQLite gets the tuned profile; in-memory databases keep the defaults
+SQLITE_TUNED = (
+    DATABASE_URL.startswith("sqlite")
+    and ":memory:" not in DATABASE_URL
+    and DATABASE_URL.rstrip("/") != "sqlite:"
+    and settings.SQLITE_TUNE.lower() in ("1", "true", "yes")
+)
+
+
+def _sqlite_pragmas(dbapi_conn, read_only: bool) -> None:
+    cur = dbapi_conn.cursor()
+    try:
+        cur.execute(f"PRAGMA busy_timeout = {settings.SQLITE_BUSY_TIMEOUT_MS}")
+        if not read_only:
+            # persistent in the file; readers then never wait on a writer's commit
+            cur.execute("PRAGMA journal_mode = WAL")
+        cur.execute(f"PRAGMA synchronous = {settings.SQLITE_SYNCHRONOUS}")
+        cur.execute(f"PRAGMA mmap_size = {settings.SQLITE_MMAP_MB * 1024 * 1024}")
+        cur.execute(f"PRAGMA cache_size = {-settings.SQLITE_CACHE_MB * 1024}")  # negative = KiB
+        if read_only:
+            cur.execute("PRAGMA query_only = ON")
+    finally:
+        cur.close()
+
+
+if SQLITE_TUNED:
+    event.listen(engine, "connect", lambda conn, _: _sqlite_pragmas(conn, read_only=False))
+    # Separate pool for the search endpoints so queries don't queue behind ingestion
+    read_engine = create_engine(
+        DATABASE_URL, pool_size=settings.READ_POOL_SIZE, max_overflow=settings.READ_POOL_SIZE, **engine_kwargs
+    )
+    event.listen(read_engine, "connect", lambda conn, _: _sqlite_pragmas(conn, read_only=True))
+else:
+    read_engine = engine
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 Base = declarative_base()
 
 # Decide embedding JSON type based on backend
 IS_POSTGRES = DATABASE_URL.startswith("postgresql")
 EmbeddingJSONType = PG_JSONB if (IS_POSTGRES and PG_JSONB is not None) else JSON
 
+# Optional pgvector column (Postgres only); the NumPy index stays the SQLite path
+USE_PGVECTOR = IS_POSTGRES and settings.PGVECTOR.lower() in ("1", "true", "yes")
+
+
+def pgvector_literal(value) -> str:
+    return "[" + ",".join(map(str, np.asarray(value, dtype=np.float32).tolist())) + "]"
+
+
+class PgVector(UserDefinedType):
+    """pgvector `vector(dim)`; binds sequences/arrays as the '[x,y,...]' text literal so
+    no pgvector Python package is needed."""
+
+    cache_ok = True
+
+    def __init__(self, dim: int) -> None:
+        self.dim = dim
+
+    def get_col_spec(self, **kw) -> str:
+        return f"vector({self.dim})"
+
+    def bind_processor(self, dialect):
+        def process(value):
+            return None if value is None else pgvector_literal(value)
+        return process
+
+
 class Document(Base):
     __tablename__ = "documents"
+    __table_args__ = (UniqueConstraint("title", "source", name="uq_documents_title_source"),)
     id = Column(Integer, primary_key=True, index=True)
     notion_page_id = Column(String, unique=True, nullable=True)
     title = Column(String, nullable=False)
@@ -45,15 +116,212 @@ class Chunk(Base):
     document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"))
     chunk_index = Column(Integer, nullable=False)
     text = Column(Text, nullable=False)
-    # Embedding as JSON/JSONB depending on backend
-    embedding = Column(EmbeddingJSONType, nullable=False)
+    # Packed little-endian float32 vector (BYTEA on Postgres) plus its layout
+    embedding_vec = Column(LargeBinary, nullable=True)
+    embedding_dim = Column(SmallInteger, nullable=True)
+    embedding_dtype = Column(String(8), nullable=True)
+    # Legacy JSON/JSONB embedding; only read for rows scripts/migrate_embeddings.py
+    # has not converted yet
+    embedding = Column(EmbeddingJSONType, nullable=True)
+    if USE_PGVECTOR:
+        embedding_pgv = Column(PgVector(settings.EMBEDDING_DIM), nullable=True)
 
     document = relationship("Document", back_populates="chunks")
 
 
+EMBEDDING_DTYPE = "<f4"
+# True while a pre-binary chunks table still has NOT NULL on the JSON column (SQLite
+# cannot drop it in place); writers then keep filling it alongside the packed vector
+# until `scripts/migrate_embeddings.py --clear-json` rebuilds the table.
+LEGACY_JSON_REQUIRED = False
+
+
+def pack_embedding(vec: Sequence[float] | np.ndarray) -> Dict[str, Any]:
+    """Chunk column values for one embedding."""
+    v = np.ascontiguousarray(vec, dtype=EMBEDDING_DTYPE)
+    fields: Dict[str, Any] = {"embedding_vec": v.tobytes(), "embedding_dim": int(v.shape[0]), "embedding_dtype": EMBEDDING_DTYPE}
+    if LEGACY_JSON_REQUIRED:
+        fields["embedding"] = v.astype(float).tolist()
+    if USE_PGVECTOR:
+        fields["embedding_pgv"] = v
+    return fields
+
+
+def unpack_embedding(blob: Optional[bytes], dim: Optional[int], dtype: Optional[str], legacy: Any = None) -> np.ndarray:
+    """Zero-copy view of a packed embedding (read-only), or the legacy JSON list."""
+    if blob is not None:
+        return np.frombuffer(blob, dtype=dtype or EMBEDDING_DTYPE, count=dim if dim is not None else -1)
+    return np.asarray(legacy, dtype=np.float32)
+
+
+def legacy_embeddings(db, chunk_ids: Sequence[int]) -> Dict[int, Any]:
+    """JSON embeddings of the given chunks that have no packed vector yet. Loaders select
+    only the packed columns and fall back to this, so converted rows never pay for
+    decoding the JSON column."""
+    table = Chunk.__table__
+    found: Dict[int, Any] = {}
+    ids = list(chunk_ids)
+    for s in range(0, len(ids), _KEY_BATCH):
+        rows = db.execute(
+            select(table.c.id, table.c.embedding).where(table.c.id.in_(ids[s : s + _KEY_BATCH]), table.c.embedding_vec.is_(None))
+        )
+        found.update((cid, emb) for cid, emb in rows if emb is not None)
+    return found
+
+
+def ensure_embedding_columns(bind=None) -> None:
+    """Add the packed-vector columns to a chunks table created before they existed and
+    relax NOT NULL on the JSON column where the dialect allows it (metadata-only changes
+    on Postgres, no table rewrite)."""
+    global LEGACY_JSON_REQUIRED
+    bind = bind or engine
+    insp = inspect(bind)
+    if not insp.has_table("chunks"):
+        return
+    cols = {c["name"]: c for c in insp.get_columns("chunks")}
+    blob = "BYTEA" if IS_POSTGRES else "BLOB"
+    with bind.begin() as conn:
+        for name, ddl in (("embedding_vec", blob), ("embedding_dim", "SMALLINT"), ("embedding_dtype", "VARCHAR(8)")):
+            if name not in cols:
+                conn.execute(text(f"ALTER TABLE chunks ADD COLUMN {name} {ddl}"))
+        legacy = cols.get("embedding")
+        required = legacy is not None and not legacy.get("nullable", True)
+        if required and IS_POSTGRES:
+            conn.execute(text("ALTER TABLE chunks ALTER COLUMN embedding DROP NOT NULL"))
+            required = False
+        # cleared again once scripts/migrate_embeddings.py has rebuilt the SQLite table
+        LEGACY_JSON_REQUIRED = required
+
+
+# False while an existing documents table has duplicate (title, source) pairs, so the
+# unique index could not be added; upserts then insert without ON CONFLICT
+DOCUMENT_KEYS_UNIQUE = True
+
+
+def ensure_document_keys(bind=None) -> None:
+    """Add the (title, source) unique index to a documents table created before it existed."""
+    global DOCUMENT_KEYS_UNIQUE
+    bind = bind or engine
+    insp = inspect(bind)
+    if not insp.has_table("documents"):
+        return
+    key = ["title", "source"]
+    if any(u["column_names"] == key for u in insp.get_unique_constraints("documents")) or any(
+        i.get("unique") and i["column_names"] == key for i in insp.get_indexes("documents")
+    ):
+        return
+    with bind.begin() as conn:
+        dupes = conn.execute(
+            text("SELECT COUNT(*) FROM (SELECT 1 FROM documents GROUP BY title, source HAVING COUNT(*) > 1) d")
+        ).scalar()
+        if dupes:
+            DOCUMENT_KEYS_UNIQUE = False
+            logger.warning("documents has %d duplicate (title, source) keys; not adding uq_documents_title_source", dupes)
+            return
+        conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_documents_title_source ON documents (title, source)"))
+
+
+def _dialect_insert(table):
+    if IS_POSTGRES:
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+# Keys per IN (...) lookup. A document lookup binds up to three parameters per key
+# (notion_page_id plus the title/source pair), so 300 keys is at most 900 parameters,
+# under the 999 host-parameter limit of SQLite builds older than 3.32.
+_KEY_BATCH = 300
+
+
+def upsert_documents(db, docs: Sequence[Dict[str, Any]]) -> List[int]:
+    """Insert or update many documents; returns their ids in input order.
+
+    Each item has title, content, source and optionally notion_page_id. A document
+    matches an existing row by notion_page_id first, then by (title, source). Existing
+    ids are resolved in one query per _KEY_BATCH keys, matches are updated with one
+    executemany, and the rest go out as INSERT ... ON CONFLICT (title, source) DO UPDATE.
+    Nothing is committed.
+    """
+    table = Document.__table__
+    c = table.c
+    by_page: Dict[str, int] = {}
+    by_key: Dict[Tuple[str, Optional[str]], int] = {}
+    page_ids = list(dict.fromkeys(d["notion_page_id"] for d in docs if d.get("notion_page_id")))
+    pairs = list(dict.fromkeys((d["title"], d.get("source")) for d in docs))
+    for s in range(0, max(len(page_ids), len(pairs)), _KEY_BATCH):
+        conds = []
+        if page_ids[s : s + _KEY_BATCH]:
+            conds.append(c.notion_page_id.in_(page_ids[s : s + _KEY_BATCH]))
+        part = pairs[s : s + _KEY_BATCH]
+        keyed = [p for p in part if p[1] is not None]
+        if keyed:
+            conds.append(tuple_(c.title, c.source).in_(keyed))
+        # (title, NULL) never equals anything in IN (...), and the unique index treats
+        # NULLs as distinct, so NULL-source keys are matched with IS NULL here
+        unsourced = [t for t, src in part if src is None]
+        if unsourced:
+            conds.append(and_(c.title.in_(unsourced), c.source.is_(None)))
+        for row in db.execute(select(c.id, c.notion_page_id, c.title, c.source).where(or_(*conds))):
+            if row.notion_page_id:
+                by_page[row.notion_page_id] = row.id
+            by_key.setdefault((row.title, row.source), row.id)
+
+    ids: List[Optional[int]] = []
+    updates: Dict[int, str] = {}
+    inserts: Dict[Tuple[str, Optional[str]], Dict[str, Any]] = {}
+    for d in docs:
+        key = (d["title"], d.get("source"))
+        doc_id = by_page.get(d.get("notion_page_id") or "") or by_key.get(key)
+        if doc_id is not None:
+            updates[doc_id] = d.get("content")
+        else:
+            # later duplicates of a key within the batch win, as with one-at-a-time upserts
+            inserts[key] = {"title": key[0], "source": key[1], "content": d.get("content"), "notion_page_id": d.get("notion_page_id")}
+        ids.append(doc_id)
+
+    if updates:
+        db.execute(
+            update(table).where(c.id == bindparam("doc_id")).values(content=bindparam("new_content")),
+            [{"doc_id": k, "new_content": v} for k, v in updates.items()],
+        )
+    if inserts:
+        stmt = _dialect_insert(table)
+        if DOCUMENT_KEYS_UNIQUE:
+            stmt = stmt.on_conflict_do_update(index_elements=[c.title, c.source], set_={"content": stmt.excluded.content})
+        for row in db.execute(stmt.returning(c.id, c.title, c.source), list(inserts.values())):
+            by_key[(row.title, row.source)] = row.id
+        ids = [i if i is not None else by_key[(d["title"], d.get("source"))] for i, d in zip(ids, docs)]
+    return ids  # type: ignore[return-value]
+
+
+def ensure_pgvector(bind=None) -> None:
+    """Extension, column and ANN index for PGVECTOR mode (see
+    supabase/sql/chunks_pgvector.ddl.sql). The index is built CONCURRENTLY so writers
+    are not blocked; existing rows are filled by scripts/migrate_embeddings.py --pgvector."""
+    bind = bind or engine
+    with bind.begin() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        conn.execute(text(f"ALTER TABLE chunks ADD COLUMN IF NOT EXISTS embedding_pgv vector({settings.EMBEDDING_DIM})"))
+    if settings.PGVECTOR_INDEX == "ivfflat":
+        using = f"ivfflat (embedding_pgv vector_cosine_ops) WITH (lists = {settings.PGVECTOR_LISTS})"
+    else:
+        using = f"hnsw (embedding_pgv vector_cosine_ops) WITH (m = {settings.HNSW_M}, ef_construction = {settings.HNSW_EF_CONSTRUCTION})"
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_chunks_embedding_pgv ON chunks USING {using}"))
+
+
 def create_all() -> None:
     try:
+        if USE_PGVECTOR:
+            with engine.begin() as conn:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
         Base.metadata.create_all(bind=engine)
+        ensure_embedding_columns()
+        ensure_document_keys()
+        if USE_PGVECTOR:
+            ensure_pgvector()
     except OperationalError as e:
         raise RuntimeError(f"Database connection failed: {e}")
 
@@ -64,3 +332,12 @@ def get_session() -> Generator:
         yield db
     finally:
         db.close()
+
+
+def get_read_session() -> Generator:
+    """Session on the read-only pool (the main engine unless SQLite is tuned)."""
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
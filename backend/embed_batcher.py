@@ -0,0 +1,104 @@
+from __future__ import annotations
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Coalesces concurrent encode calls into one batched call.
+
+    Callers enqueue their texts and block on a future; a single worker thread takes
+    the first pending request, keeps collecting for up to `max_wait_ms` or until
+    `max_batch` texts are queued, runs `encode` once and splits the result back.
+    """
+
+    def __init__(self, encode: Callable[[List[str]], np.ndarray], max_batch: int = 64, max_wait_ms: float = 2.0) -> None:
+        self._encode = encode
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue: "queue.Queue[Tuple[List[str], Future]]" = queue.Queue()
+        self._pending_texts = 0
+        self._worker: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._stats: Dict[str, float] = {
+            "requests": 0,
+            "batches": 0,
+            "texts": 0,
+            "max_batch_size": 0,
+            "max_queue_depth": 0,
+            "errors": 0,
+            "encode_ms": 0.0,
+        }
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        fut: Future = Future()
+        with self._lock:
+            self._ensure_worker()
+            self._pending_texts += len(texts)
+            self._stats["requests"] += 1
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._pending_texts)
+        self._queue.put((texts, fut))
+        return fut.result()
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+            self._worker.start()
+
+    def _collect(self) -> List[Tuple[List[str], Future]]:
+        batch = [self._queue.get()]
+        count = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while count < self.max_batch:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=left)
+            except queue.Empty:
+                break
+            batch.append(item)
+            count += len(item[0])
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            texts = [t for req, _ in batch for t in req]
+            with self._lock:
+                self._pending_texts -= len(texts)
+            t0 = time.perf_counter()
+            try:
+                embs = self._encode(texts)
+            except Exception as e:
+                logger.exception("Batched encode of %d texts failed", len(texts))
+                with self._lock:
+                    self._stats["errors"] += 1
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            with self._lock:
+                self._stats["batches"] += 1
+                self._stats["texts"] += len(texts)
+                self._stats["max_batch_size"] = max(self._stats["max_batch_size"], len(texts))
+                self._stats["encode_ms"] += (time.perf_counter() - t0) * 1000
+            s = 0
+            for req, fut in batch:
+                fut.set_result(embs[s : s + len(req)])
+                s += len(req)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._stats)
+            out["queue_depth"] = self._pending_texts
+        out["encode_ms"] = round(out["encode_ms"], 1)
+        out["avg_batch_size"] = round(out["texts"] / out["batches"], 2) if out["batches"] else 0.0
+        out["max_batch"] = self.max_batch
+        out["max_wait_ms"] = self.max_wait * 1000
+        return out
@@ -0,0 +1,92 @@
+from __future__ import annotations
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Dict, Sequence
+import numpy as np
+
+from .config import settings
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model TEXT NOT NULL,
+    digest BLOB NOT NULL,
+    dim INTEGER NOT NULL,
+    vec BLOB NOT NULL,
+    PRIMARY KEY (model, digest)
+) WITHOUT ROWID
+"""
+# Stay under SQLite's default host-parameter limit
+_BATCH = 500
+
+
+def text_digest(text: str) -> bytes:
+    """sha256 of the whitespace-normalized text."""
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """Persistent content-addressed cache: (model id, text digest) -> float32 vector.
+
+    Backed by a single SQLite file in WAL mode so the API and ingestion scripts can
+    share it; re-ingesting unchanged chunk text then skips the model entirely.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def get_many(self, model: str, digests: Sequence[bytes]) -> Dict[bytes, np.ndarray]:
+        found: Dict[bytes, np.ndarray] = {}
+        uniq = list(dict.fromkeys(digests))
+        with self._lock:
+            conn = self._connect()
+            for s in range(0, len(uniq), _BATCH):
+                part = uniq[s : s + _BATCH]
+                marks = ",".join("?" * len(part))
+                rows = conn.execute(
+                    f"SELECT digest, dim, vec FROM embeddings WHERE model = ? AND digest IN ({marks})",
+                    [model, *part],
+                )
+                for digest, dim, vec in rows:
+                    found[bytes(digest)] = np.frombuffer(vec, dtype=np.float32, count=dim)
+            self.hits += len(found)
+            self.misses += len(uniq) - len(found)
+        return found
+
+    def put_many(self, model: str, digests: Sequence[bytes], vectors: np.ndarray) -> None:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        rows = [(model, d, int(v.shape[0]), v.tobytes()) for d, v in zip(digests, vectors)]
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO embeddings (model, digest, dim, vec) VALUES (?, ?, ?, ?)", rows)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+_cache: EmbeddingCache | None = None
+
+
+def get_cache() -> EmbeddingCache | None:
+    """Process-wide cache, or None when EMBEDDING_CACHE_PATH is empty."""
+    global _cache
+    if _cache is None and settings.EMBEDDING_CACHE_PATH:
+        _cache = EmbeddingCache(settings.EMBEDDING_CACHE_PATH)
+    return _cache
@@ -0,0 +1,67 @@
+from __future__ import annotations
+import multiprocessing as mp
+import os
+from typing import List, Tuple
+import numpy as np
+
+
+def _init_worker(threads: int) -> None:
+    # Split the cores between workers instead of every worker's BLAS/torch using all of them
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    try:
+        import torch  # type: ignore
+
+        torch.set_num_threads(threads)
+    except Exception:
+        pass
+    from . import embedding_service
+
+    embedding_service.model_id()  # load the model once per worker
+
+
+def _encode(texts: List[str]) -> Tuple[np.ndarray, str]:
+    from . import embedding_service
+
+    embs, produced_by = embedding_service._embed_with_id(texts, bulk=True)
+    return np.asarray(embs, dtype=np.float32), produced_by
+
+
+def _model_id() -> str:
+    from . import embedding_service
+
+    return embedding_service.model_id()
+
+
+class EmbeddingPool:
+    """Process pool for bulk ingestion: each worker loads the embedding model once and
+    encodes the shards it is sent. Use as a context manager."""
+
+    def __init__(self, workers: int, shard_size: int = 256) -> None:
+        self.workers = max(1, workers)
+        self.shard_size = shard_size
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        self._pool = mp.get_context("spawn").Pool(self.workers, initializer=_init_worker, initargs=(threads,))
+        self.model_id = self._pool.apply(_model_id)
+
+    def submit(self, texts: List[str]) -> List["mp.pool.AsyncResult"]:
+        """Queue `texts` in shards of at most shard_size; results come back via collect()."""
+        return [self._pool.apply_async(_encode, (texts[s : s + self.shard_size],)) for s in range(0, len(texts), self.shard_size)]
+
+    @staticmethod
+    def collect(pending: List["mp.pool.AsyncResult"]) -> Tuple[np.ndarray, str]:
+        parts = [p.get() for p in pending]
+        ids = {mid for _, mid in parts}
+        return np.vstack([e for e, _ in parts]), (ids.pop() if len(ids) == 1 else "mixed")
+
+    def close(self) -> None:
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self) -> "EmbeddingPool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if exc[0] is not None:
+            self._pool.terminate()
+        self.close()
@@ -1,54 +1,260 @@
 from __future__ import annotations
-from typing import List, Any
+from functools import lru_cache
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Iterable, Iterator, List, Tuple
 import numpy as np
 
+from . import embedding_cache
+from .cache import LRUCache
+from .embed_batcher import MicroBatcher
+from .config import settings
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+HASHING_MODEL_ID = "hashing-384"
+
 _ModelType = Any
 _model_cache: _ModelType | None = None
 _model_ok: bool = False
+_model_lock = threading.Lock()
+_model_failed_at: float | None = None
 
 
 def _try_load_model() -> _ModelType | None:
-    global _model_cache, _model_ok
+    """Load the sentence-transformer once; after a failure, retry at most every
+    MODEL_RETRY_SECONDS (the hashing fallback serves in between)."""
+    global _model_cache, _model_ok, _model_failed_at
     if _model_cache is not None:
         return _model_cache
-    try:
-        from sentence_transformers import SentenceTransformer  # type: ignore
-        _model_cache = SentenceTransformer(
-            "sentence-transformers/all-MiniLM-L6-v2",
-            cache_folder="models/embeddings",
-            device="cpu",
-        )
-        _model_ok = True
-    except Exception:
-        _model_cache = None
-        _model_ok = False
+    if _model_failed_at is not None and time.monotonic() - _model_failed_at < settings.MODEL_RETRY_SECONDS:
+        return None
+    with _model_lock:
+        if _model_cache is not None:
+            return _model_cache
+        try:
+            from sentence_transformers import SentenceTransformer  # type: ignore
+            _model_cache = SentenceTransformer(
+                MODEL_NAME,
+                cache_folder="models/embeddings",
+                device="cpu",
+            )
+            _model_ok = True
+            _model_failed_at = None
+        except Exception:
+            _model_cache = None
+            _model_ok = False
+            _model_failed_at = time.monotonic()
     return _model_cache
 
 
-def _hashing_embed(texts: List[str], dim: int = 384) -> np.ndarray:
-    # Deterministic simple hashing embedding for environments without Torch
+@lru_cache(maxsize=4)
+def _hashing_projection(dim: int) -> np.ndarray:
+    # Fixed random projection matrix (seeded) for hashing sim; built once per process
     rng = np.random.default_rng(42)
-    # Fixed random projection matrix (seeded) for hashing sim
     proj = rng.standard_normal((dim, 256), dtype=np.float32)
-    embs = []
-    for t in texts:
-        # Build 256-dim histogram of bytes
-        h = np.zeros(256, dtype=np.float32)
-        for b in t.encode("utf-8", errors="ignore"):
-            h[b] += 1.0
-        v = proj @ (h / (np.linalg.norm(h) + 1e-9))
-        # normalize
-        v = v / (np.linalg.norm(v) + 1e-9)
-        embs.append(v)
-    return np.vstack(embs)
-
-
-def embed_texts(texts: List[str]) -> np.ndarray:
+    proj.setflags(write=False)
+    return proj
+
+
+def _hashing_embed(texts: List[str], dim: int = 384) -> np.ndarray:
+    # Deterministic simple hashing embedding for environments without Torch:
+    # normalized UTF-8 byte histograms through a fixed random projection
+    proj = _hashing_projection(dim)
+    encoded = [t.encode("utf-8", errors="ignore") for t in texts]
+    lengths = np.fromiter((len(b) for b in encoded), dtype=np.int64, count=len(encoded))
+    codes = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    rows = np.repeat(np.arange(len(encoded), dtype=np.int64), lengths)
+    h = np.bincount(rows * 256 + codes, minlength=len(encoded) * 256).astype(np.float32).reshape(-1, 256)
+    out = np.empty((len(encoded), dim), dtype=np.float32)
+    # Per-row matvec and 1-D norms rather than one matmul: BLAS sums in a different
+    # order for matrix-matrix products, and stored vectors must stay bit-identical.
+    for i, row in enumerate(h):
+        v = proj @ (row / (np.linalg.norm(row) + 1e-9))
+        out[i] = v / (np.linalg.norm(v) + 1e-9)
+    return out
+
+
+def _bulk_encode(model, texts: List[str], batch_size: int) -> np.ndarray:
+    """Encode in buckets of similar token length so short texts (CSV rows) are not padded
+    to the longest chunk of an arbitrary batch; results come back in input order."""
+    try:
+        enc = model.tokenizer(texts, add_special_tokens=False, truncation=True, max_length=model.max_seq_length or 512)
+        lengths = [len(ids) for ids in enc["input_ids"]]
+    except Exception:
+        lengths = [len(t) for t in texts]
+    order = np.argsort(lengths, kind="stable")
+    out: np.ndarray | None = None
+    for s in range(0, len(texts), batch_size):
+        idx = order[s : s + batch_size]
+        embs = model.encode(
+            [texts[i] for i in idx], batch_size=len(idx), show_progress_bar=False,
+            convert_to_numpy=True, normalize_embeddings=True,
+        )
+        if out is None:
+            out = np.empty((len(texts), embs.shape[1]), dtype=embs.dtype)
+        out[idx] = embs
+    return out if out is not None else np.empty((0, 0), dtype=np.float32)
+
+
+def _embed_with_id(texts: List[str], bulk: bool = False) -> Tuple[np.ndarray, str]:
+    """Embeddings plus the id of the embedder that actually produced them."""
     model = _try_load_model()
     if _model_ok and model is not None:
         try:
-            return model.encode(texts, show_progress_bar=False, convert_to_numpy=True, normalize_embeddings=True)
+            if bulk and len(texts) > settings.EMBED_BULK_BATCH_SIZE:
+                return _bulk_encode(model, texts, settings.EMBED_BULK_BATCH_SIZE), MODEL_NAME
+            return model.encode(texts, show_progress_bar=False, convert_to_numpy=True, normalize_embeddings=True), MODEL_NAME
         except Exception:
             pass
-    # fallback hashing embeddings
-    return _hashing_embed(texts)
+    # fallback hashing embeddings (cost doesn't depend on batch composition)
+    return _hashing_embed(texts), HASHING_MODEL_ID
+
+
+def embed_texts(texts: List[str], bulk: bool = False) -> np.ndarray:
+    """bulk=True buckets large inputs by token length (see _bulk_encode); use it for
+    ingestion-sized batches of mixed-length texts."""
+    return _embed_with_id(texts, bulk=bulk)[0]
+
+
+def _start_documents(texts: List[str], pool=None):
+    """First half of embed_documents: cache lookup, then encode the misses, either
+    inline or queued on `pool`."""
+    cache = embedding_cache.get_cache()
+    mid = pool.model_id if pool is not None else model_id()
+    digests = [embedding_cache.text_digest(t) for t in texts]
+    found = cache.get_many(mid, digests) if cache is not None else {}
+    todo = list(dict.fromkeys(d for d in digests if d not in found))
+    work = None
+    if todo:
+        first = {d: i for i, d in reversed(list(enumerate(digests)))}
+        missing = [texts[first[d]] for d in todo]
+        work = pool.submit(missing) if pool is not None else _embed_with_id(missing, bulk=True)
+    return mid, digests, found, todo, work, pool
+
+
+def _finish_documents(started) -> np.ndarray:
+    mid, digests, found, todo, work, pool = started
+    if todo:
+        embs, produced_by = pool.collect(work) if pool is not None else work
+        embs = np.asarray(embs, dtype=np.float32)
+        cache = embedding_cache.get_cache()
+        if cache is not None and produced_by == mid:
+            cache.put_many(mid, todo, embs)
+        found.update(zip(todo, embs))
+    if not digests:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.vstack([found[d] for d in digests])
+
+
+def embed_documents(texts: List[str]) -> np.ndarray:
+    """embed_texts for ingestion, consulting the persistent content-addressed cache
+    (EMBEDDING_CACHE_PATH) first so unchanged chunk text is never re-embedded."""
+    if embedding_cache.get_cache() is None or not texts:
+        return embed_texts(texts, bulk=True)
+    return _finish_documents(_start_documents(texts))
+
+
+def _grouped(items: Iterable[Tuple[Any, List[str]]], max_texts: int) -> Iterator[List[Tuple[Any, List[str]]]]:
+    group: List[Tuple[Any, List[str]]] = []
+    count = 0
+    for payload, texts in items:
+        group.append((payload, texts))
+        count += len(texts)
+        if count >= max_texts:
+            yield group
+            group, count = [], 0
+    if group:
+        yield group
+
+
+def _split(group: List[Tuple[Any, List[str]]], embs: np.ndarray) -> Iterator[Tuple[Any, np.ndarray]]:
+    s = 0
+    for payload, texts in group:
+        yield payload, embs[s : s + len(texts)]
+        s += len(texts)
+
+
+def embed_documents_iter(items: Iterable[Tuple[Any, List[str]]], workers: int = 1) -> Iterator[Tuple[Any, np.ndarray]]:
+    """embed_documents over a stream of (payload, texts), yielding (payload, embeddings)
+    in input order. Consecutive items are coalesced into groups of about
+    EMBED_BULK_TEXTS texts, so documents of one or two chunks (CSV rows) still reach the
+    model in full, length-bucketed batches. With workers > 1, cache misses are encoded
+    by an EmbeddingPool and up to 2 * workers groups are kept in flight ahead of the
+    consumer."""
+    groups = _grouped(items, max(1, settings.EMBED_BULK_TEXTS))
+    if workers <= 1:
+        for group in groups:
+            yield from _split(group, embed_documents([t for _, texts in group for t in texts]))
+        return
+    from .embedding_pool import EmbeddingPool
+
+    with EmbeddingPool(workers) as pool:
+        window: Deque[Tuple[Any, Any]] = deque()
+        for group in groups:
+            window.append((group, _start_documents([t for _, texts in group for t in texts], pool)))
+            if len(window) > 2 * workers:
+                head, started = window.popleft()
+                yield from _split(head, _finish_documents(started))
+        while window:
+            head, started = window.popleft()
+            yield from _split(head, _finish_documents(started))
+
+
+def document_cache_stats() -> dict:
+    cache = embedding_cache.get_cache()
+    return cache.stats() if cache is not None else {}
+
+
+def model_id() -> str:
+    """Identifier of the embedder currently producing vectors (cache keys depend on it)."""
+    _try_load_model()
+    return MODEL_NAME if _model_ok else HASHING_MODEL_ID
+
+
+# Query-side cache: short search queries repeat a lot. Ingestion calls embed_texts
+# directly so bulk traffic never evicts hot queries.
+_query_cache = LRUCache(max_items=settings.QUERY_CACHE_SIZE, ttl=settings.QUERY_CACHE_TTL or None)
+
+
+def _query_key(text: str) -> str:
+    return " ".join(text.split())
+
+
+# Concurrent search handlers each embed one short query; the batcher merges them into
+# one model.encode call. The hashing fallback gains nothing from batching, so it and
+# EMBED_BATCH_WAIT_MS=0 bypass the queue.
+_batcher = MicroBatcher(embed_texts, max_batch=settings.EMBED_BATCH_MAX_SIZE, max_wait_ms=settings.EMBED_BATCH_WAIT_MS)
+
+
+def _encode_queries(texts: List[str]) -> np.ndarray:
+    if settings.EMBED_BATCH_WAIT_MS <= 0 or not _model_ok:
+        return embed_texts(texts)
+    return _batcher.encode(texts)
+
+
+def embed_queries(texts: List[str]) -> np.ndarray:
+    """embed_texts for search queries, served from an LRU/TTL cache keyed on
+    (model id, whitespace-normalized text)."""
+    mid = model_id()
+    keys = [(mid, _query_key(t)) for t in texts]
+    out: List[np.ndarray | None] = [_query_cache.get(k) for k in keys]
+    missing = [i for i, v in enumerate(out) if v is None]
+    if missing:
+        # de-duplicate within the batch before hitting the model
+        uniq = list(dict.fromkeys(keys[i][1] for i in missing))
+        embs = _encode_queries(uniq)
+        by_text = {t: embs[j] for j, t in enumerate(uniq)}
+        for i in missing:
+            v = by_text[keys[i][1]]
+            _query_cache.put(keys[i], v)
+            out[i] = v
+    return np.vstack(out)
+
+
+def query_cache_stats() -> dict:
+    return _query_cache.stats()
+
+
+def batcher_stats() -> dict:
+    return _batcher.stats()
@@ -0,0 +1,203 @@
+from __future__ import annotations
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Tuple
+import numpy as np
+
+from .config import settings
+
+# On-disk layout (all little-endian, append-only except tombstones):
+#   embeddings.f32  raw float32 rows, row-major, `dim` values per row (normalized)
+#   rows.i64        raw int64 pairs (chunk_id, document_id) per row; -1 marks a dead row
+#   meta.json       {"dim", "dtype", "rows"}: rows is the committed row count
+VEC_FILE = "embeddings.f32"
+ROWS_FILE = "rows.i64"
+META_FILE = "meta.json"
+LOCK_FILE = ".lock"
+
+
+@contextmanager
+def _file_lock(path: str, timeout: float = 30.0, stale_after: float = 300.0) -> Iterator[None]:
+    """Portable cross-process lock (O_EXCL lock file); stale locks are broken after `stale_after`."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.close(fd)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > stale_after:
+                    os.remove(path)
+                    continue
+            except OSError:
+                pass
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Embedding store is locked: {path}")
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class EmbeddingStore:
+    """Append-only float32 vector file plus a chunk id -> row map, opened with np.memmap.
+
+    Readers map the vector file without copying; the row table (16 bytes per row) is
+    the only part read into RAM. Replacing a document tombstones its old rows in place
+    and appends the new ones; the files are compacted once dead rows pile up.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _read_meta(self) -> dict:
+        try:
+            with open(self._file(META_FILE), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"dim": 0, "dtype": "float32", "rows": 0}
+
+    def _write_meta(self, dim: int, rows: int) -> None:
+        tmp = self._file(META_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"dim": int(dim), "dtype": "float32", "rows": int(rows)}, f)
+        os.replace(tmp, self._file(META_FILE))
+
+    # --- readers -------------------------------------------------------------
+
+    def open(self) -> Tuple[np.ndarray | None, np.ndarray]:
+        """Return (vectors, rows) where vectors is a read-only memmap of shape (n, dim)
+        and rows an (n, 2) int64 array of (chunk_id, document_id)."""
+        meta = self._read_meta()
+        n, dim = int(meta.get("rows", 0)), int(meta.get("dim", 0))
+        if n == 0 or dim == 0:
+            return None, np.empty((0, 2), dtype=np.int64)
+        try:
+            rows = np.fromfile(self._file(ROWS_FILE), dtype=np.int64, count=n * 2).reshape(n, 2)
+            vectors = np.memmap(self._file(VEC_FILE), dtype=np.float32, mode="r", shape=(n, dim))
+        except (OSError, ValueError):
+            return None, np.empty((0, 2), dtype=np.int64)
+        return vectors, rows
+
+    def matches(self, count: int, max_chunk_id: int) -> bool:
+        """Cheap consistency check against the chunks table (live count and max id)."""
+        _, rows = self.open()
+        live = rows[rows[:, 0] >= 0, 0]
+        return int(live.size) == int(count) and int(live.max() if live.size else 0) == int(max_chunk_id)
+
+    # --- writers -------------------------------------------------------------
+
+    def rewrite(self, batches: Iterable[Tuple[np.ndarray, np.ndarray, np.ndarray]]) -> None:
+        """Replace the whole store (backfill from SQL) from (chunk_ids, doc_ids, vectors)
+        batches. Each batch is appended to temp files as it arrives, so peak memory is one
+        batch rather than the corpus; the files are swapped in under the lock at the end."""
+        tmp = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            dim, n = self._write_files(batches, tmp)
+            with self._lock, _file_lock(self._file(LOCK_FILE)):
+                self._swap_files(tmp, dim, n)
+        finally:
+            for name in (VEC_FILE, ROWS_FILE):
+                try:
+                    os.remove(self._file(name + tmp))
+                except OSError:
+                    pass
+
+    def _write_files(self, batches: Iterable[Tuple[np.ndarray, np.ndarray, np.ndarray]], suffix: str) -> Tuple[int, int]:
+        dim = n = 0
+        with open(self._file(VEC_FILE + suffix), "wb") as vf, open(self._file(ROWS_FILE + suffix), "wb") as rf:
+            for chunk_ids, doc_ids, vectors in batches:
+                if not len(chunk_ids):
+                    continue
+                vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+                if dim and vectors.shape[1] != dim:
+                    raise ValueError(f"Embedding dim {vectors.shape[1]} does not match store dim {dim}")
+                dim = vectors.shape[1]
+                rows = np.stack([np.asarray(chunk_ids, dtype=np.int64), np.asarray(doc_ids, dtype=np.int64)], axis=1)
+                vectors.tofile(vf)
+                rows.tofile(rf)
+                n += len(rows)
+        return dim, n
+
+    def _swap_files(self, suffix: str, dim: int, n: int) -> None:
+        for name in (VEC_FILE, ROWS_FILE):
+            os.replace(self._file(name + suffix), self._file(name))
+        self._write_meta(dim, n)
+
+    def replace_document(self, document_id: int, chunk_ids, vectors: np.ndarray) -> None:
+        vectors = np.ascontiguousarray(np.atleast_2d(vectors), dtype=np.float32)
+        with self._lock, _file_lock(self._file(LOCK_FILE)):
+            meta = self._read_meta()
+            n, dim = int(meta.get("rows", 0)), int(meta.get("dim", 0))
+            dead = 0
+            if n:
+                rows = np.memmap(self._file(ROWS_FILE), dtype=np.int64, mode="r+", shape=(n, 2))
+                hit = np.flatnonzero(rows[:, 1] == document_id)
+                if hit.size:
+                    rows[hit] = -1
+                    rows.flush()
+                dead = int((rows[:, 0] < 0).sum())
+                del rows
+            if len(chunk_ids):
+                if dim and vectors.shape[1] != dim:
+                    raise ValueError(f"Embedding dim {vectors.shape[1]} does not match store dim {dim}")
+                new_rows = np.empty((len(chunk_ids), 2), dtype=np.int64)
+                new_rows[:, 0] = np.asarray(chunk_ids, dtype=np.int64)
+                new_rows[:, 1] = document_id
+                # Truncate any tail left by an interrupted append before writing past it
+                with open(self._file(VEC_FILE), "ab") as f:
+                    f.truncate(n * dim * 4)
+                    vectors.tofile(f)
+                with open(self._file(ROWS_FILE), "ab") as f:
+                    f.truncate(n * 16)
+                    new_rows.tofile(f)
+                n += len(chunk_ids)
+                dim = vectors.shape[1]
+            self._write_meta(dim, n)
+        if dead > max(1024, n // 4):
+            self.compact()
+
+    def compact(self) -> None:
+        with self._lock, _file_lock(self._file(LOCK_FILE)):
+            vectors, rows = self.open()
+            if vectors is None:
+                return
+            keep = np.flatnonzero(rows[:, 0] >= 0)
+            step = 65536
+            batches = ((rows[keep[s : s + step], 0], rows[keep[s : s + step], 1], vectors[keep[s : s + step]])
+                       for s in range(0, keep.size, step))
+            try:
+                dim, n = self._write_files(batches, ".tmp")
+                del vectors
+                self._swap_files(".tmp", dim, n)
+            except OSError:
+                # e.g. the old file is still mapped on Windows; retry on the next write
+                pass
+
+
+_store: EmbeddingStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> EmbeddingStore | None:
+    """Process-wide store, or None when EMBEDDING_STORE_DIR is empty (store disabled)."""
+    global _store
+    if not settings.EMBEDDING_STORE_DIR:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = EmbeddingStore(settings.EMBEDDING_STORE_DIR)
+        return _store
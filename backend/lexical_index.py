@@ -0,0 +1,270 @@
+from __future__ import annotations
+import re
+import threading
+import time
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .db import Chunk
+
+# Word tokens, keeping codes such as "15-1252.00" or "5025211001" intact
+_TOKEN_RE = re.compile(r"\w+(?:[-./]\w+)*", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    toks: List[str] = []
+    for t in _TOKEN_RE.findall(text.lower()):
+        toks.append(t)
+        if not t.isalnum():
+            # also index the parts of compound codes so "1252" matches "15-1252.00"
+            toks.extend(p for p in re.split(r"[-./]", t) if p)
+    return toks
+
+
+class LexicalIndex:
+    """In-memory BM25 inverted index over chunk text.
+
+    The bulk of the postings lives in CSR form (term-sorted int32 row / uint16 tf
+    arrays); chunks added afterwards go to a term-sorted delta of the same layout that
+    is folded into the main arrays once it grows past an eighth of them. Removed chunks
+    are tombstoned and compacted away once they pass a quarter of the rows, as in the
+    vector index.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._vocab: Dict[str, int] = {}
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._rows = np.empty(0, dtype=np.int32)
+        self._tfs = np.empty(0, dtype=np.uint16)
+        self._delta_terms = np.empty(0, dtype=np.int64)
+        self._delta_rows = np.empty(0, dtype=np.int32)
+        self._delta_tfs = np.empty(0, dtype=np.uint16)
+        self._chunk_ids = np.empty(0, dtype=np.int64)
+        self._doc_ids = np.empty(0, dtype=np.int64)
+        self._lengths = np.empty(0, dtype=np.float32)
+        self._size = 0
+        self._dead = 0
+        self._total_len = 0.0
+        self._loaded = False
+        self._checked_at = 0.0
+
+    def __len__(self) -> int:
+        return self._size - self._dead
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def _term_counts(self, text: str, grow: bool) -> Tuple[np.ndarray, np.ndarray]:
+        toks = tokenize(text)
+        ids = []
+        for t in toks:
+            tid = self._vocab.get(t)
+            if tid is None:
+                if not grow:
+                    continue
+                tid = self._vocab[t] = len(self._vocab)
+            ids.append(tid)
+        if not ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.unique(np.asarray(ids, dtype=np.int64), return_counts=True)
+
+    # --- loading / syncing -------------------------------------------------
+
+    def load(self, db: Session, batch_size: int = 5000) -> None:
+        with self._lock:
+            self._vocab = {}
+            term_parts: List[np.ndarray] = []
+            row_parts: List[np.ndarray] = []
+            tf_parts: List[np.ndarray] = []
+            ids: List[int] = []
+            docs: List[int] = []
+            lengths: List[int] = []
+            q = db.query(Chunk.id, Chunk.document_id, Chunk.text).order_by(Chunk.id)
+            for cid, did, text in q.yield_per(batch_size):
+                terms, counts = self._term_counts(text or "", grow=True)
+                row = len(ids)
+                ids.append(cid)
+                docs.append(did if did is not None else -1)
+                lengths.append(int(counts.sum()))
+                term_parts.append(terms)
+                row_parts.append(np.full(terms.size, row, dtype=np.int32))
+                tf_parts.append(np.minimum(counts, 65535).astype(np.uint16))
+            terms = np.concatenate(term_parts) if term_parts else np.empty(0, dtype=np.int64)
+            order = np.argsort(terms, kind="stable")
+            self._set_postings(
+                terms[order],
+                np.concatenate(row_parts)[order] if row_parts else np.empty(0, dtype=np.int32),
+                np.concatenate(tf_parts)[order] if tf_parts else np.empty(0, dtype=np.uint16),
+            )
+            self._clear_delta()
+            self._chunk_ids = np.array(ids, dtype=np.int64)
+            self._doc_ids = np.array(docs, dtype=np.int64)
+            self._lengths = np.array(lengths, dtype=np.float32)
+            self._size = len(ids)
+            self._dead = 0
+            self._total_len = float(self._lengths.sum())
+            self._loaded = True
+            self._checked_at = time.monotonic()
+
+    def sync(self, db: Session) -> None:
+        """Same out-of-process change check as VectorIndex.sync."""
+        if not self._loaded:
+            self.load(db)
+            return
+        now = time.monotonic()
+        if now - self._checked_at < settings.VECTOR_INDEX_SYNC_SECONDS:
+            return
+        self._checked_at = now
+        count, max_id = db.query(func.count(Chunk.id), func.max(Chunk.id)).one()
+        live = self._chunk_ids[: self._size]
+        live = live[live >= 0]
+        if int(count or 0) != live.size or int(max_id or 0) != int(live.max() if live.size else 0):
+            self.load(db)
+
+    # --- incremental updates -----------------------------------------------
+
+    def _set_postings(self, terms: np.ndarray, rows: np.ndarray, tfs: np.ndarray) -> None:
+        """Install term-sorted postings as the main CSR arrays. Caller holds the lock."""
+        self._rows, self._tfs = rows.astype(np.int32, copy=False), tfs.astype(np.uint16, copy=False)
+        counts = np.bincount(terms, minlength=len(self._vocab))
+        self._offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    def _clear_delta(self) -> None:
+        self._delta_terms = np.empty(0, dtype=np.int64)
+        self._delta_rows = np.empty(0, dtype=np.int32)
+        self._delta_tfs = np.empty(0, dtype=np.uint16)
+
+    def _main_terms(self) -> np.ndarray:
+        return np.repeat(np.arange(self._offsets.shape[0] - 1, dtype=np.int64), np.diff(self._offsets))
+
+    def _fold_delta(self) -> None:
+        """Merge the delta into the main arrays (stable, so rows stay ascending per term)."""
+        if not self._delta_terms.size:
+            return
+        terms = np.concatenate([self._main_terms(), self._delta_terms])
+        order = np.argsort(terms, kind="stable")
+        self._set_postings(
+            terms[order],
+            np.concatenate([self._rows, self._delta_rows])[order],
+            np.concatenate([self._tfs, self._delta_tfs])[order],
+        )
+        self._clear_delta()
+
+    def _compact(self) -> None:
+        """Drop tombstoned rows and their postings, renumbering the live rows."""
+        self._fold_delta()
+        live = self._chunk_ids[: self._size] >= 0
+        new_pos = (np.cumsum(live) - 1).astype(np.int32)
+        keep = live[self._rows]
+        self._set_postings(self._main_terms()[keep], new_pos[self._rows[keep]], self._tfs[keep])
+        rows = np.flatnonzero(live)
+        self._chunk_ids = self._chunk_ids[rows]
+        self._doc_ids = self._doc_ids[rows]
+        self._lengths = self._lengths[rows]
+        self._size = int(rows.size)
+        self._dead = 0
+
+    def replace_document(self, document_id: int, chunk_ids: Sequence[int], texts: Sequence[str]) -> None:
+        with self._lock:
+            rows = np.flatnonzero(self._doc_ids[: self._size] == document_id)
+            if rows.size:
+                self._chunk_ids[rows] = -1
+                self._doc_ids[rows] = -1
+                self._total_len -= float(self._lengths[rows].sum())
+                self._lengths[rows] = 0
+                self._dead += int(rows.size)
+                if self._dead > max(1024, self._size // 4):
+                    self._compact()
+            n = len(chunk_ids)
+            if self._size + n > self._chunk_ids.shape[0]:
+                cap = max(self._size + n, 2 * self._size, 1024)
+                self._chunk_ids = np.concatenate([self._chunk_ids[: self._size], np.full(cap - self._size, -1, dtype=np.int64)])
+                self._doc_ids = np.concatenate([self._doc_ids[: self._size], np.full(cap - self._size, -1, dtype=np.int64)])
+                self._lengths = np.concatenate([self._lengths[: self._size], np.zeros(cap - self._size, dtype=np.float32)])
+            term_parts = [self._delta_terms]
+            row_parts = [self._delta_rows]
+            tf_parts = [self._delta_tfs]
+            for cid, text in zip(chunk_ids, texts):
+                row = self._size
+                terms, counts = self._term_counts(text or "", grow=True)
+                term_parts.append(terms)
+                row_parts.append(np.full(terms.size, row, dtype=np.int32))
+                tf_parts.append(np.minimum(counts, 65535).astype(np.uint16))
+                self._chunk_ids[row] = cid
+                self._doc_ids[row] = document_id
+                self._lengths[row] = float(counts.sum())
+                self._total_len += float(counts.sum())
+                self._size += 1
+            terms = np.concatenate(term_parts)
+            order = np.argsort(terms, kind="stable")
+            self._delta_terms = terms[order]
+            self._delta_rows = np.concatenate(row_parts)[order]
+            self._delta_tfs = np.concatenate(tf_parts)[order]
+            if self._delta_terms.size > max(65536, self._rows.size // 8):
+                self._fold_delta()
+
+    def _postings(self, tid: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Main plus delta postings of one term. Caller holds the lock."""
+        if tid + 1 < self._offsets.shape[0]:
+            s, e = self._offsets[tid], self._offsets[tid + 1]
+            rows, tfs = self._rows[s:e], self._tfs[s:e]
+        else:
+            rows, tfs = np.empty(0, dtype=np.int32), np.empty(0, dtype=np.uint16)
+        ds, de = np.searchsorted(self._delta_terms, [tid, tid + 1])
+        if de > ds:
+            rows = np.concatenate([rows, self._delta_rows[ds:de]])
+            tfs = np.concatenate([tfs, self._delta_tfs[ds:de]])
+        return rows, tfs
+
+    # --- search ------------------------------------------------------------
+
+    def search(self, query: str, k: int, document_ids: np.ndarray | None = None) -> List[Tuple[int, float]]:
+        """BM25 top-k as (chunk_id, score), best first, optionally limited to `document_ids`."""
+        with self._lock:
+            terms, qtf = self._term_counts(query, grow=False)
+            size, live = self._size, self._size - self._dead
+            ids, docs, lengths = self._chunk_ids, self._doc_ids, self._lengths
+            avgdl = self._total_len / live if live else 0.0
+            # postings taken with the snapshot: compaction renumbers rows
+            postings = [self._postings(tid) for tid in terms.tolist()]
+        if terms.size == 0 or live <= 0 or k <= 0:
+            return []
+        scores = np.zeros(size, dtype=np.float32)
+        norm = self.k1 * (1 - self.b + self.b * lengths[:size] / (avgdl or 1.0))
+        for (rows, tfs), weight in zip(postings, qtf.tolist()):
+            tf = tfs.astype(np.float32)
+            if rows.size == 0:
+                continue
+            df = int((ids[rows] >= 0).sum())
+            idf = np.log(1.0 + (live - df + 0.5) / (df + 0.5))
+            # rows are unique within a term's postings, so plain fancy-index add is safe
+            scores[rows] += weight * idf * tf * (self.k1 + 1) / (tf + norm[rows])
+        scores[ids[:size] < 0] = 0.0
+        if document_ids is not None:
+            scores[~np.isin(docs[:size], document_ids)] = 0.0
+        nz = np.flatnonzero(scores > 0)
+        if nz.size == 0:
+            return []
+        k = min(k, nz.size)
+        top = nz[np.argpartition(-scores[nz], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[r]), float(scores[r])) for r in top]
+
+
+_index = LexicalIndex()
+
+
+def get_index() -> LexicalIndex:
+    return _index
+
+
+def on_document_chunks_written(document_id: int, chunk_ids: Sequence[int], texts: Sequence[str]) -> None:
+    if _index.loaded:
+        _index.replace_document(document_id, chunk_ids, texts)
@@ -2,15 +2,29 @@ from __future__ import annotations
 from fastapi import FastAPI, Depends, HTTPException, Body, Header
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import List, NamedTuple, Optional
 import json
-from fastapi.responses import StreamingResponse
+import numpy as np
+from fastapi.responses import JSONResponse, StreamingResponse
 import os
 
-from .db import create_all, get_session, Document, Chunk
-from .schemas import ChatRequest, ChatResponse, IDPRequest, IDPResponse, Opportunity, SearchRequest, SearchResult
+from .db import create_all, get_read_session, get_session, SessionLocal, Document, Chunk
+from .chunk_writer import ChunkWriter
+from .schemas import (
+    ChatRequest, ChatResponse, IDPRequest, IDPResponse, Opportunity,
+    SearchRequest, SearchResult, BatchSearchRequest, BatchSearchResult,
+)
 from . import ai_core
 from . import embedding_service
+from . import vector_index
+from . import lexical_index
+from . import pgvector_search
+from . import reranker
+from . import rag_context
+from . import warmup
+from .ranking import mmr_select, rrf_fuse
+from .cache import LRUCache
+from .config import settings
 from .notion_service import NotionService
 from datetime import datetime
 
@@ -34,80 +48,141 @@ def _local_chunk_text(text: str, max_chars: int = 1000, overlap: int = 200) -> L
         start = max(0, end - overlap)
     return chunks
 
-# Retrieval + reranker helpers (FAISS optional, reranker optional)
-_index_cache = {
-    "rows_len": 0,
-    "matrix": None,
-}
-
-def _get_rows_and_matrix(db: Session):
-    import numpy as np
-    rows = db.query(Chunk, Document).join(Document, Chunk.document_id == Document.id).all()
-    if not rows:
-        return [], None
-    embs = [row[0].embedding for row in rows]
-    m = np.array(embs, dtype=float)
-    return rows, m
-
-_reranker = None
+# Retrieval + reranker helpers (in-process vector index, reranker optional)
+class ChunkRow(NamedTuple):
+    id: int
+    chunk_index: int
+    text: str
+
+class DocRow(NamedTuple):
+    id: int
+    title: str
+
+def _fetch_chunk_rows(db: Session, chunk_ids: List[int]) -> dict:
+    """{chunk_id: (ChunkRow, DocRow)} for just these ids, selecting only the columns the
+    responses use (never Chunk.embedding or Document.content)."""
+    if not chunk_ids:
+        return {}
+    rows = (
+        db.query(Chunk.id, Chunk.chunk_index, Chunk.text, Document.id, Document.title)
+        .join(Document, Chunk.document_id == Document.id)
+        .filter(Chunk.id.in_(chunk_ids))
+        .all()
+    )
+    return {cid: (ChunkRow(cid, idx, text), DocRow(did, title)) for cid, idx, text, did, title in rows}
 
 def _load_reranker():
-    global _reranker
-    if _reranker is not None:
-        return _reranker
-    enabled = os.getenv("RERANKER_ENABLED", "0").lower() in ("1", "true", "yes")
-    if not enabled:
-        return None
-    try:
-        from sentence_transformers import CrossEncoder
-        model_name = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
-        _reranker = CrossEncoder(model_name, device="cpu")
-        return _reranker
-    except Exception:
-        _reranker = None
-        return None
-
-def _retrieve_similar(db: Session, query: str, top_k: int = 5, preselect: int = 50):
-    import numpy as np
-    from numpy.linalg import norm
-    rows, m = _get_rows_and_matrix(db)
-    if not rows:
-        return []
-    q = embedding_service.embed_texts([query])[0]
-    # Try FAISS inner product over normalized vectors; fallback to numpy cosine
-    try:
-        import faiss  # type: ignore
-        m_norm = m / (norm(m, axis=1, keepdims=True) + 1e-9)
-        q_norm = q / (norm(q) + 1e-9)
-        index = faiss.IndexFlatIP(m.shape[1])
-        index.add(m_norm.astype("float32"))
-        nprobe = min(preselect, len(rows))
-        scores, idxs = index.search(q_norm.reshape(1, -1).astype("float32"), nprobe)
-        cand = [(int(idxs[0][i]), float(scores[0][i])) for i in range(idxs.shape[1])]
-    except Exception:
-        denom = (norm(m, axis=1) * norm(q) + 1e-9)
-        sims = (m @ q) / denom
-        order = sims.argsort()[::-1]
-        nprobe = min(preselect, len(order))
-        cand = [(int(order[i]), float(sims[int(order[i])])) for i in range(nprobe)]
-
-    # Optional rerank with cross-encoder
-    reranker = _load_reranker()
-    if reranker:
-        pairs = [(query, rows[i][0].text) for i, _ in cand]
-        try:
-            scores = reranker.predict(pairs)
-            ranked = sorted(zip(cand, scores), key=lambda x: float(x[1]), reverse=True)
-            cand = [(i, float(score)) for ((i, _), score) in ranked]
-        except Exception:
-            pass
-
-    cand = cand[:top_k]
-    results = []
-    for idx, score in cand:
-        chunk, doc = rows[idx]
-        results.append((chunk, doc, float(score)))
-    return results
+    return reranker.get_reranker()
+
+def _ready_index(db: Session):
+    """The dense search backend: pgvector when enabled (Postgres), else the in-process index."""
+    if pgvector_search.enabled():
+        return pgvector_search.PgVectorSearch(db, vector_index.get_index().generation)
+    index = vector_index.get_index()
+    index.sync(db)
+    return index if len(index) else None
+
+def _rank_candidates(index, query: str, hits, rows: dict, top_k: int, mmr_lambda: float):
+    """Optional cross-encoder rerank, then optional MMR diversification (mmr_lambda < 1)
+    over the candidate vectors; returns the final (chunk_id, score) list. Only the
+    reranker needs `rows` (for the chunk text)."""
+    cand = list(hits)
+    if _load_reranker() is not None:
+        cand = [(cid, score) for cid, score in cand if cid in rows]
+        cand = reranker.rerank(query, cand, {cid: rows[cid][0].text for cid, _ in cand})
+    if mmr_lambda < 1.0 and len(cand) > top_k:
+        vecs = index.vectors([cid for cid, _ in cand])
+        picked = mmr_select(np.array([score for _, score in cand]), vecs, top_k, mmr_lambda)
+        cand = [cand[i] for i in picked]
+    return [(cid, float(score)) for cid, score in cand[:top_k]]
+
+def _materialize(ranked, rows: dict):
+    return [(rows[cid][0], rows[cid][1], score) for cid, score in ranked if cid in rows]
+
+# Final (chunk_id, score) lists keyed by query/params and the index generation, so any
+# committed write makes older entries unreachable; LRU + byte cap bound the footprint.
+_result_cache = LRUCache(
+    max_items=settings.RESULT_CACHE_SIZE,
+    max_bytes=settings.RESULT_CACHE_MAX_BYTES,
+    sizeof=lambda ranked: 64 + 40 * len(ranked),
+)
+
+def _result_key(index, query: str, top_k: int, preselect: int, mode: str, mmr_lambda: float, sources, document_ids):
+    return (
+        " ".join(query.split()), top_k, preselect, mode, mmr_lambda,
+        frozenset(sources or ()), frozenset(document_ids or ()),
+        _load_reranker() is not None, index.generation,
+    )
+
+def _retrieve_similar(
+    db: Session,
+    query: str,
+    top_k: int = 5,
+    preselect: int = 50,
+    mode: Optional[str] = None,
+    sources: Optional[List[str]] = None,
+    document_ids: Optional[List[int]] = None,
+    mmr_lambda: Optional[float] = None,
+):
+    return _retrieve_similar_batch(
+        db, [query], top_k=top_k, preselect=preselect, mode=mode, sources=sources,
+        document_ids=document_ids, mmr_lambda=mmr_lambda,
+    )[0]
+
+def _retrieve_similar_batch(
+    db: Session,
+    queries: List[str],
+    top_k: int = 5,
+    preselect: int = 50,
+    mode: Optional[str] = None,
+    sources: Optional[List[str]] = None,
+    document_ids: Optional[List[int]] = None,
+    mmr_lambda: Optional[float] = None,
+):
+    """Retrieve for several queries: cached ones skip straight to the row fetch, the rest
+    share one embed call and one matrix-matrix scan; rows come from a single IN query.
+
+    mode "hybrid" fuses BM25 candidates with the dense ones (reciprocal-rank fusion)
+    before the optional cross-encoder; scores are then RRF scores unless reranked.
+    sources/document_ids restrict the scan inside the index (no post-filtering).
+    mmr_lambda < 1 picks the final top_k by maximal marginal relevance, so overlapping
+    neighbouring chunks don't crowd out other context.
+    """
+    mode = (mode or settings.RETRIEVAL_MODE).lower()
+    mmr_lambda = settings.MMR_LAMBDA if mmr_lambda is None else min(1.0, max(0.0, float(mmr_lambda)))
+    index = _ready_index(db)
+    if index is None:
+        return [[] for _ in queries]
+    pre = max(preselect, top_k)
+    keys = [_result_key(index, q, top_k, preselect, mode, mmr_lambda, sources, document_ids) for q in queries]
+    ranked = [_result_cache.get(k) for k in keys]
+    missing = [i for i, r in enumerate(ranked) if r is None]
+    hits_per_query = {}
+    if missing:
+        qs = embedding_service.embed_queries([queries[i] for i in missing])
+        dense = index.search_batch(qs, pre, sources=sources, document_ids=document_ids)
+        for i, hits in zip(missing, dense):
+            hits_per_query[i] = hits
+        if mode == "hybrid":
+            lex = lexical_index.get_index()
+            lex.sync(db)
+            allowed = index.documents_matching(sources, document_ids)
+            for i in missing:
+                lex_hits = lex.search(queries[i], pre, document_ids=allowed)
+                hits_per_query[i] = rrf_fuse([hits_per_query[i], lex_hits], limit=pre)
+    # Scoring above only touched ids and vectors; text/title are fetched for the final
+    # top_k (plus the reranker's candidates, which need the text) in one IN query.
+    rows = {}
+    if _load_reranker() is not None:
+        wanted = {cid for r in ranked if r for cid, _ in r}
+        wanted.update(cid for hits in hits_per_query.values() for cid, _ in hits)
+        rows = _fetch_chunk_rows(db, sorted(wanted))
+    for i, hits in hits_per_query.items():
+        ranked[i] = _rank_candidates(index, queries[i], hits, rows, top_k, mmr_lambda)
+        _result_cache.put(keys[i], ranked[i])
+    wanted = {cid for r in ranked for cid, _ in r} - rows.keys()
+    rows.update(_fetch_chunk_rows(db, sorted(wanted)))
+    return [_materialize(r, rows) for r in ranked]
 
 # CORS origins configurable via env CORS_ORIGINS (comma-separated or "*")
 origins_env = os.getenv("CORS_ORIGINS", "*")
@@ -123,14 +198,30 @@ app.add_middleware(
 @app.on_event("startup")
 def on_startup():
     create_all()
+    db = SessionLocal()
+    try:
+        if not pgvector_search.enabled():
+            vector_index.get_index().load(db)
+        if settings.RETRIEVAL_MODE == "hybrid":
+            lexical_index.get_index().load(db)
+    finally:
+        db.close()
+    if settings.WARMUP_MODELS.lower() in ("1", "true", "yes"):
+        warmup.start()
 
 @app.get("/health")
-def health(db: Session = Depends(get_session)):
+def health(db: Session = Depends(get_read_session)):
     # basic DB check and counts
     docs = db.query(Document).count()
     chs = db.query(Chunk).count()
     return {"status": "ok", "documents": docs, "chunks": chs}
 
+@app.get("/ready")
+def ready():
+    # load-balancer readiness: 503 until the READY_REQUIRE models are warm
+    ok, state = warmup.readiness()
+    return JSONResponse(state, status_code=200 if ok else 503)
+
 @app.post("/api/chat", response_model=ChatResponse)
 def api_chat(req: ChatRequest) -> ChatResponse:
     content = ai_core.chat([m.model_dump() for m in req.messages])
@@ -190,32 +281,38 @@ def admin_etl_refresh(categories: Optional[List[str]] = None, _: bool = Depends(
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/admin/stats")
-def admin_stats(db: Session = Depends(get_session), _: bool = Depends(admin_guard)):
+def admin_stats(db: Session = Depends(get_read_session), _: bool = Depends(admin_guard)):
     docs = db.query(Document).count()
     chs = db.query(Chunk).count()
-    return {"documents": docs, "chunks": chs}
+    return {
+        "documents": docs,
+        "chunks": chs,
+        "index_generation": vector_index.get_index().generation,
+        "vector_index": vector_index.get_index().memory_stats(),
+        "query_embedding_cache": embedding_service.query_cache_stats(),
+        "query_embedding_batches": embedding_service.batcher_stats(),
+        "document_embedding_cache": embedding_service.document_cache_stats(),
+        "retrieval_result_cache": _result_cache.stats(),
+        "reranker": reranker.stats(),
+    }
 
 # Admin: manual indexing of arbitrary text
 @app.post("/admin/index")
 def admin_index(payload: dict = Body(...), db: Session = Depends(get_session), _: bool = Depends(admin_guard)):
     title = (payload or {}).get("title")
     content = (payload or {}).get("content")
-    source = (payload or {}).get("source", "Manual")
+    source = (payload or {}).get("source") or "Manual"
     if not title or not content:
         raise HTTPException(status_code=400, detail="title and content are required")
     pieces = _local_chunk_text(content)
     if not pieces:
         return {"status": "ok", "message": "No content to index"}
-    embs = embedding_service.embed_texts(pieces).astype(float)
-    # create doc
-    doc = Document(title=title, content=content, source=source)
-    db.add(doc)
-    db.flush()
-    for idx, (txt, emb) in enumerate(zip(pieces, embs)):
-        ch = Chunk(document_id=doc.id, chunk_index=idx, text=txt, embedding=emb.tolist())
-        db.add(ch)
-    db.commit()
-    return {"status": "ok", "document_id": doc.id, "chunks": len(pieces)}
+    embs = embedding_service.embed_documents(pieces)
+    # create the doc, or replace the one with the same title and source
+    writer = ChunkWriter(db)
+    (doc_id,) = writer.write_documents([({"title": title, "content": content, "source": source}, pieces, embs)])
+    writer.commit()
+    return {"status": "ok", "document_id": doc_id, "chunks": len(pieces)}
 
 @app.get("/api/opportunities", response_model=List[Opportunity])
 def api_opportunities() -> List[Opportunity]:
@@ -238,22 +335,64 @@ def api_list_docs(include_content: bool = False, category: Optional[str] = None)
     items = svc.list_documents(category=category, include_content=include_content)
     return items
 
-@app.post("/api/rag")
-def api_rag(payload: dict = Body(...), db: Session = Depends(get_session)):
+_RAG_SYSTEM = ("Anda adalah NEXUS. Jawablah pertanyaan berbasis konteks berikut. "
+               "Jika jawaban tidak ada dalam konteks, katakan tidak tahu. "
+               "Cantumkan sumber sebagai [Judul#Chunk]. Jawab ringkas dan akurat.")
+
+def _rag_retrieve(payload: dict, db: Session):
     query = (payload or {}).get("query")
     k = int((payload or {}).get("k", 5))
-    temperature = float((payload or {}).get("temperature", 0.2))
     if not query:
         raise HTTPException(status_code=400, detail="query is required")
+    # the RAG payload is a plain dict: normalize the filters the way SearchRequest would
+    sources = (payload or {}).get("sources")
+    if isinstance(sources, str):
+        sources = [sources]
+    if sources is not None and not (isinstance(sources, list) and all(isinstance(x, str) for x in sources)):
+        raise HTTPException(status_code=400, detail="sources must be a string or a list of strings")
+    mode = (payload or {}).get("mode")
+    if mode is not None and mode not in ("dense", "hybrid"):
+        raise HTTPException(status_code=400, detail='mode must be "dense" or "hybrid"')
+    mmr_lambda = (payload or {}).get("mmr_lambda")
+    if mmr_lambda is None:
+        mmr_lambda = settings.RAG_MMR_LAMBDA
+    try:
+        mmr_lambda = float(mmr_lambda)
+    except (TypeError, ValueError):
+        mmr_lambda = None
+    if mmr_lambda is None or not 0.0 <= mmr_lambda <= 1.0:
+        raise HTTPException(status_code=400, detail="mmr_lambda must be a number between 0 and 1")
+    document_ids = (payload or {}).get("document_ids")
+    if isinstance(document_ids, int) and not isinstance(document_ids, bool):
+        document_ids = [document_ids]
+    if document_ids is not None and not (
+        isinstance(document_ids, list) and all(isinstance(x, int) and not isinstance(x, bool) for x in document_ids)
+    ):
+        raise HTTPException(status_code=400, detail="document_ids must be an integer or a list of integers")
+    results = _retrieve_similar(
+        db, query, top_k=k, preselect=max(10, k * 5), mode=mode,
+        sources=sources, document_ids=document_ids,
+        mmr_lambda=mmr_lambda,
+    )
+    return query, results
+
+def _rag_prompt(query: str, results):
+    """Pack the retrieved chunks into the token budget; returns (user message, used, report)."""
+    budget = rag_context.context_budget(_RAG_SYSTEM, query, settings.RAG_MAX_NEW_TOKENS)
+    contexts, used, report = rag_context.pack_context(results, budget)
+    user = f"Konteks:\n\n" + "\n\n".join(contexts) + f"\n\nPertanyaan: {query}"
+    return user, used, report
 
-    results = _retrieve_similar(db, query, top_k=k, preselect=max(10, k * 5))
+@app.post("/api/rag")
+def api_rag(payload: dict = Body(...), db: Session = Depends(get_read_session)):
+    temperature = float((payload or {}).get("temperature", 0.2))
+    query, results = _rag_retrieve(payload, db)
     if not results:
         return {"answer": "", "sources": []}
 
-    contexts = []
+    user, used, report = _rag_prompt(query, results)
     sources = []
-    for chunk, doc, score in results:
-        contexts.append(f"[{doc.title}#{chunk.chunk_index}]\n{chunk.text}")
+    for chunk, doc, score in used:
         sources.append({
             "document_title": doc.title,
             "chunk_index": chunk.chunk_index,
@@ -261,42 +400,26 @@ def api_rag(payload: dict = Body(...), db: Session = Depends(get_session)):
             "text": chunk.text,
         })
 
-    system = ("Anda adalah NEXUS. Jawablah pertanyaan berbasis konteks berikut. "
-              "Jika jawaban tidak ada dalam konteks, katakan tidak tahu. "
-              "Cantumkan sumber sebagai [Judul#Chunk]. Jawab ringkas dan akurat.")
-    user = f"Konteks:\n\n" + "\n\n".join(contexts) + f"\n\nPertanyaan: {query}"
     messages = [
-        {"role": "system", "content": system},
+        {"role": "system", "content": _RAG_SYSTEM},
         {"role": "user", "content": user},
     ]
-    answer = ai_core.chat(messages, max_tokens=700, temperature=temperature)
-    return {"answer": answer, "sources": sources}
+    answer = ai_core.chat(messages, max_tokens=settings.RAG_MAX_NEW_TOKENS, temperature=temperature)
+    return {"answer": answer, "sources": sources, "context": report}
 
 # SSE streaming for RAG responses
 @app.post("/api/rag/stream")
-def api_rag_stream(payload: dict = Body(...), db: Session = Depends(get_session)):
-    query = (payload or {}).get("query")
-    k = int((payload or {}).get("k", 5))
+def api_rag_stream(payload: dict = Body(...), db: Session = Depends(get_read_session)):
     temperature = float((payload or {}).get("temperature", 0.2))
-    if not query:
-        raise HTTPException(status_code=400, detail="query is required")
-
-    results = _retrieve_similar(db, query, top_k=k, preselect=max(10, k * 5))
-    contexts = []
-    for chunk, doc, score in results:
-        contexts.append(f"[{doc.title}#{chunk.chunk_index}]\n{chunk.text}")
-
-    system = ("Anda adalah NEXUS. Jawablah pertanyaan berbasis konteks berikut. "
-              "Jika jawaban tidak ada dalam konteks, katakan tidak tahu. "
-              "Cantumkan sumber sebagai [Judul#Chunk]. Jawab ringkas dan akurat.")
-    user = f"Konteks:\n\n" + "\n\n".join(contexts) + f"\n\nPertanyaan: {query}"
+    query, results = _rag_retrieve(payload, db)
+    user, _, report = _rag_prompt(query, results)
 
     def token_gen():
         llm = ai_core.get_llm()
-        prompt = f"<s>[INST] {system}\n\n{user} [/INST]"
+        prompt = f"<s>[INST] {_RAG_SYSTEM}\n\n{user} [/INST]"
         for chunk in llm(
             prompt,
-            max_tokens=700,
+            max_tokens=settings.RAG_MAX_NEW_TOKENS,
             temperature=temperature,
             stream=True,
             stop=["</s>", "[INST]", "</INST>", "USER:", "ASSISTANT:"],
@@ -305,11 +428,14 @@ def api_rag_stream(payload: dict = Body(...), db: Session = Depends(get_session)
             if token:
                 yield f"data: {json.dumps({'token': token})}\n\n"
         yield "data: [DONE]\n\n"
-    return StreamingResponse(token_gen(), media_type="text/event-stream")
-
-@app.post("/api/search", response_model=List[SearchResult])
-def api_search(req: SearchRequest, db: Session = Depends(get_session)) -> List[SearchResult]:
-    res = _retrieve_similar(db, req.query, top_k=req.k, preselect=max(10, req.k * 5))
+    headers = {
+        "X-Context-Budget-Tokens": str(report["budget_tokens"]),
+        "X-Context-Used-Tokens": str(report["used_tokens"]),
+        "X-Context-Chunks": str(report["chunks_used"]),
+    }
+    return StreamingResponse(token_gen(), media_type="text/event-stream", headers=headers)
+
+def _to_search_results(res) -> List[SearchResult]:
     results: List[SearchResult] = []
     for chunk, doc, score in res:
         results.append(
@@ -321,3 +447,19 @@ def api_search(req: SearchRequest, db: Session = Depends(get_session)) -> List[S
             )
         )
     return results
+
+@app.post("/api/search", response_model=List[SearchResult])
+def api_search(req: SearchRequest, db: Session = Depends(get_read_session)) -> List[SearchResult]:
+    res = _retrieve_similar(
+        db, req.query, top_k=req.k, preselect=max(10, req.k * 5),
+        mode=req.mode, sources=req.sources, document_ids=req.document_ids, mmr_lambda=req.mmr_lambda,
+    )
+    return _to_search_results(res)
+
+@app.post("/api/search/batch", response_model=List[BatchSearchResult])
+def api_search_batch(req: BatchSearchRequest, db: Session = Depends(get_read_session)) -> List[BatchSearchResult]:
+    res = _retrieve_similar_batch(
+        db, req.queries, top_k=req.k, preselect=max(10, req.k * 5),
+        mode=req.mode, sources=req.sources, document_ids=req.document_ids, mmr_lambda=req.mmr_lambda,
+    )
+    return [BatchSearchResult(query=q, results=_to_search_results(r)) for q, r in zip(req.queries, res)]
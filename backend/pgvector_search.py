@@ -0,0 +1,121 @@
+from __future__ import annotations
+import threading
+import time
+from typing import Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy import bindparam, func, text
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .db import USE_PGVECTOR, Chunk, Document, legacy_embeddings, pgvector_literal, unpack_embedding
+
+# Generation for result-cache keys: bumped when the throttled COUNT/MAX check sees
+# another process change the chunks table (the in-process index is not loaded in this mode)
+_gen_lock = threading.Lock()
+_generation = 0
+_seen: Tuple[int, int] | None = None
+_checked_at = 0.0
+
+
+def enabled() -> bool:
+    return USE_PGVECTOR
+
+
+def _sync_generation(db: Session) -> int:
+    global _generation, _seen, _checked_at
+    now = time.monotonic()
+    if now - _checked_at < settings.VECTOR_INDEX_SYNC_SECONDS:
+        return _generation
+    count, max_id = db.query(func.count(Chunk.id), func.max(Chunk.id)).one()
+    with _gen_lock:
+        _checked_at = now
+        seen = (int(count or 0), int(max_id or 0))
+        if seen != _seen:
+            _seen = seen
+            _generation += 1
+        return _generation
+
+
+class PgVectorSearch:
+    """Dense search issued to Postgres/pgvector, with the same search_batch / vectors /
+    documents_matching surface as VectorIndex so the retrieval pipeline is unchanged.
+
+    Source/document filters go into the WHERE clause; with an HNSW index Postgres
+    applies them to the ef_search candidates, so very selective filters can return
+    fewer than k rows (raise HNSW_EF_SEARCH, or pass exact=True).
+    """
+
+    def __init__(self, db: Session, local_generation: int = 0) -> None:
+        self.db = db
+        # in-process writes bump the (unloaded) VectorIndex generation via the writer hook
+        self.generation = (local_generation, _sync_generation(db))
+
+    def search_batch(
+        self,
+        query_vecs: np.ndarray,
+        k: int,
+        exact: bool = False,
+        sources: Optional[Iterable[str]] = None,
+        document_ids: Optional[Iterable[int]] = None,
+    ) -> List[List[Tuple[int, float]]]:
+        Q = np.atleast_2d(query_vecs)
+        # empty filters mean "no filter", as in VectorIndex._filter_rows
+        sources = list(sources or ())
+        document_ids = [int(d) for d in (document_ids or ())]
+        where = ["c.embedding_pgv IS NOT NULL"]
+        params = {"k": int(k)}
+        binds = []
+        if sources:
+            where.append("d.source IN :sources")
+            params["sources"] = sources
+            binds.append(bindparam("sources", expanding=True))
+        if document_ids:
+            where.append("c.document_id IN :docs")
+            params["docs"] = document_ids
+            binds.append(bindparam("docs", expanding=True))
+        join = "JOIN documents d ON d.id = c.document_id " if sources else ""
+        stmt = text(
+            "SELECT c.id, 1 - (c.embedding_pgv <=> CAST(:q AS vector)) AS score FROM chunks c "
+            + join + "WHERE " + " AND ".join(where)
+            + " ORDER BY c.embedding_pgv <=> CAST(:q AS vector) LIMIT :k"
+        ).bindparams(*binds)
+        if exact:
+            self.db.execute(text("SET LOCAL enable_indexscan = off"))
+        else:
+            if settings.PGVECTOR_INDEX == "ivfflat":
+                self.db.execute(text(f"SET LOCAL ivfflat.probes = {int(settings.PGVECTOR_PROBES)}"))
+            else:
+                self.db.execute(text(f"SET LOCAL hnsw.ef_search = {max(int(settings.HNSW_EF_SEARCH), int(k))}"))
+        out = []
+        for q in Q:
+            rows = self.db.execute(stmt, {**params, "q": pgvector_literal(q)}).all()
+            out.append([(int(cid), float(score)) for cid, score in rows])
+        return out
+
+    def vectors(self, chunk_ids: Sequence[int]) -> np.ndarray:
+        rows = (
+            self.db.query(Chunk.id, Chunk.embedding_vec, Chunk.embedding_dim, Chunk.embedding_dtype)
+            .filter(Chunk.id.in_(list(chunk_ids)))
+            .all()
+        )
+        legacy = legacy_embeddings(self.db, [cid for cid, b, _, _ in rows if b is None])
+        found = {cid: unpack_embedding(b, d, t, legacy.get(cid)) for cid, b, d, t in rows}
+        dim = next((v.shape[0] for v in found.values()), settings.EMBEDDING_DIM)
+        out = np.zeros((len(chunk_ids), dim), dtype=np.float32)
+        for i, cid in enumerate(chunk_ids):
+            v = found.get(cid)
+            if v is not None:
+                out[i] = v / (np.linalg.norm(v) + 1e-9)
+        return out
+
+    def documents_matching(self, sources: Optional[Iterable[str]] = None, document_ids: Optional[Iterable[int]] = None) -> np.ndarray | None:
+        sources = list(sources or ())
+        document_ids = [int(d) for d in (document_ids or ())]
+        if not sources and not document_ids:
+            return None
+        q = self.db.query(Document.id)
+        if sources:
+            q = q.filter(Document.source.in_(sources))
+        if document_ids:
+            q = q.filter(Document.id.in_(document_ids))
+        return np.array([d for (d,) in q], dtype=np.int64)
@@ -0,0 +1,66 @@
+from __future__ import annotations
+import numpy as np
+
+
+class Int8Quantizer:
+    """Per-dimension scalar quantization of normalized embeddings to int8.
+
+    x ~= offset + scale * (code + 128). Inner products are computed directly on the
+    codes: x.q ~= offset.q + 128 * scale.q + code.(scale * q), converting one block of
+    codes to float32 at a time so the full float matrix is never materialized.
+    """
+
+    def __init__(self) -> None:
+        self.codes = np.empty((0, 0), dtype=np.int8)
+        self.scale: np.ndarray | None = None
+        self.offset: np.ndarray | None = None
+        self.size = 0
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.codes[: self.size].nbytes)
+
+    def fit(self, matrix: np.ndarray, size: int, block: int = 65536) -> None:
+        lo = np.full(matrix.shape[1], np.inf, dtype=np.float32)
+        hi = np.full(matrix.shape[1], -np.inf, dtype=np.float32)
+        for s in range(0, size, block):
+            blk = np.asarray(matrix[s : min(size, s + block)], dtype=np.float32)
+            lo = np.minimum(lo, blk.min(axis=0))
+            hi = np.maximum(hi, blk.max(axis=0))
+        self.offset = lo
+        self.scale = np.maximum(hi - lo, 1e-6) / 255.0
+        self.codes = np.empty((0, matrix.shape[1]), dtype=np.int8)
+        self.size = 0
+        self.extend(matrix, size, block)
+
+    def encode(self, x: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint((x - self.offset) / self.scale) - 128, -128, 127).astype(np.int8)
+
+    def extend(self, matrix: np.ndarray, size: int, block: int = 65536) -> None:
+        """Quantize rows [self.size, size) with the fitted parameters (values outside
+        the fitted range are clipped)."""
+        if size <= self.size:
+            return
+        if size > self.codes.shape[0]:
+            codes = np.empty((max(size, 2 * self.codes.shape[0]), matrix.shape[1]), dtype=np.int8)
+            codes[: self.size] = self.codes[: self.size]
+            self.codes = codes
+        for s in range(self.size, size, block):
+            e = min(size, s + block)
+            self.codes[s:e] = self.encode(np.asarray(matrix[s:e], dtype=np.float32))
+        self.size = size
+
+    def scores(self, Q: np.ndarray, size: int, rows: np.ndarray | None = None, block: int = 4096) -> np.ndarray:
+        """Approximate Q inner products for the first `size` rows (or only `rows`);
+        shape (rows, queries)."""
+        qs = (Q * self.scale).T.astype(np.float32)  # (d, B)
+        const = Q @ self.offset + 128.0 * (Q @ self.scale)  # (B,)
+        codes_all = self.codes
+        n = size if rows is None else rows.size
+        out = np.empty((n, Q.shape[0]), dtype=np.float32)
+        for s in range(0, n, block):
+            e = min(n, s + block)
+            codes = codes_all[s:e] if rows is None else codes_all[rows[s:e]]
+            out[s:e] = codes.astype(np.float32) @ qs
+        out += const
+        return out
@@ -0,0 +1,66 @@
+from __future__ import annotations
+from typing import Any, Dict, List, Sequence, Tuple
+
+from . import ai_core
+from .config import settings
+
+# Tokens held back for the chat template and separators the counts don't see
+_TEMPLATE_MARGIN = 16
+# Don't bother truncating a chunk into less than this
+_MIN_TRUNCATED_TOKENS = 48
+
+
+def context_budget(system: str, query: str, max_new_tokens: int) -> int:
+    """Prompt tokens left for context: the window minus the answer, the system prompt and
+    the question, capped at RAG_CONTEXT_TOKENS when that is set."""
+    fixed = ai_core.count_tokens(system)[0] + ai_core.count_tokens(query)[0]
+    available = settings.LLM_CONTEXT - max_new_tokens - fixed - _TEMPLATE_MARGIN
+    if settings.RAG_CONTEXT_TOKENS > 0:
+        available = min(available, settings.RAG_CONTEXT_TOKENS)
+    return max(0, available)
+
+
+def _block(chunk, doc, text: str | None = None) -> str:
+    return f"[{doc.title}#{chunk.chunk_index}]\n{chunk.text if text is None else text}"
+
+
+def pack_context(results: Sequence[Tuple[Any, Any, float]], budget: int) -> Tuple[List[str], List[Tuple[Any, Any, float]], Dict[str, Any]]:
+    """Fit ranked (chunk, doc, score) results into `budget` tokens, best first.
+
+    Chunks that don't fit are dropped (lower-ranked ones may still fill the gap); if
+    not even the best chunk fits, it is cut down to the budget rather than sending no
+    context. Returns (context blocks, results used, report).
+    """
+    blocks: List[str] = []
+    used: List[Tuple[Any, Any, float]] = []
+    spent = 0
+    truncated = False
+    exact = ai_core.get_llm() is not None
+    for chunk, doc, score in results:
+        block = _block(chunk, doc)
+        n, exact = ai_core.count_tokens(block)
+        n += 2  # "\n\n" separator
+        if spent + n > budget:
+            left = budget - spent
+            if blocks or left < _MIN_TRUNCATED_TOKENS:
+                continue
+            text = chunk.text
+            while text and n > left:
+                text = text[: int(len(text) * left / n * 0.95)]
+                block = _block(chunk, doc, text)
+                n = ai_core.count_tokens(block)[0] + 2
+            if not text:
+                continue
+            truncated = True
+        blocks.append(block)
+        used.append((chunk, doc, score))
+        spent += n
+    report = {
+        "budget_tokens": budget,
+        "used_tokens": spent,
+        "chunks_used": len(used),
+        "chunks_dropped": len(results) - len(used),
+        "truncated": truncated,
+        "tokenizer": "model" if exact else "estimate",
+    }
+    return blocks, used, report
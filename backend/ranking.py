@@ -0,0 +1,42 @@
+from __future__ import annotations
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+
+
+def rrf_fuse(ranked_lists: Sequence[Sequence[Tuple[int, float]]], limit: int, k: int = 60) -> List[Tuple[int, float]]:
+    """Reciprocal-rank fusion of several (id, score) rankings; returns (id, rrf_score)."""
+    fused: Dict[int, float] = {}
+    for ranking in ranked_lists:
+        for rank, (cid, _) in enumerate(ranking):
+            fused[cid] = fused.get(cid, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)[:limit]
+
+
+def mmr_select(relevance: np.ndarray, vectors: np.ndarray, k: int, lambda_: float = 0.7) -> List[int]:
+    """Maximal marginal relevance: pick k candidate positions, each maximizing
+    lambda * relevance - (1 - lambda) * max cosine to the already picked ones.
+
+    `relevance` is rescaled to [0, 1] so dense, RRF and cross-encoder scores trade off
+    the same way; `vectors` must be L2-normalized. The pairwise similarities are one
+    matrix product and each greedy step is a vectorized update, so the only Python
+    loop is over the k picks.
+    """
+    n = relevance.shape[0]
+    k = min(k, n)
+    if k <= 0:
+        return []
+    rel = relevance.astype(np.float32)
+    span = float(rel.max() - rel.min())
+    rel = (rel - rel.min()) / span if span > 0 else np.ones_like(rel)
+    sim = vectors @ vectors.T
+    max_sim = np.full(n, -np.inf, dtype=np.float32)
+    picked = np.zeros(n, dtype=bool)
+    order: List[int] = []
+    for step in range(k):
+        mmr = lambda_ * rel - (1.0 - lambda_) * (max_sim if step else 0.0)
+        mmr[picked] = -np.inf
+        i = int(np.argmax(mmr))
+        order.append(i)
+        picked[i] = True
+        max_sim = np.maximum(max_sim, sim[i])
+    return order
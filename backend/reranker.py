@@ -0,0 +1,113 @@
+from __future__ import annotations
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Sequence, Tuple
+
+from .cache import LRUCache
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+_reranker: Any | None = None
+_load_lock = threading.Lock()
+_failed_at: float | None = None
+
+# (model, query, chunk_id) -> cross-encoder score. Chunk ids are never reused for new
+# text (replaced chunks get new ids), so entries cannot go stale.
+_score_cache = LRUCache(max_items=settings.RERANK_CACHE_SIZE)
+_stats_lock = threading.Lock()
+_stats: Dict[str, float] = {
+    "calls": 0,
+    "pairs_scored": 0,
+    "budget_fallbacks": 0,
+    "errors": 0,
+    "total_ms": 0.0,
+}
+
+
+def enabled() -> bool:
+    return settings.RERANKER_ENABLED.lower() in ("1", "true", "yes")
+
+
+def get_reranker():
+    """Lazy-load the CrossEncoder; None when disabled or unavailable. After a failed
+    load, retries at most every MODEL_RETRY_SECONDS."""
+    global _reranker, _failed_at
+    if _reranker is not None or not enabled():
+        return _reranker
+    if _failed_at is not None and time.monotonic() - _failed_at < settings.MODEL_RETRY_SECONDS:
+        return None
+    with _load_lock:
+        if _reranker is None:
+            try:
+                from sentence_transformers import CrossEncoder
+                _reranker = CrossEncoder(settings.RERANKER_MODEL, device="cpu")
+                _failed_at = None
+            except Exception:
+                logger.exception("Failed to load reranker %s", settings.RERANKER_MODEL)
+                _reranker = None
+                _failed_at = time.monotonic()
+    return _reranker
+
+
+def _bump(**kw: float) -> None:
+    with _stats_lock:
+        for k, v in kw.items():
+            _stats[k] += v
+
+
+def rerank(query: str, cand: Sequence[Tuple[int, float]], texts: Dict[int, str]) -> List[Tuple[int, float]]:
+    """Re-order dense candidates by cross-encoder score.
+
+    Pairs are scored in batches of RERANK_BATCH_SIZE, best dense candidates first, with
+    scores reused from the cache. If the RERANK_BUDGET_MS budget runs out (or the model
+    fails) the dense order is returned unchanged.
+    """
+    model = get_reranker()
+    if model is None or not cand:
+        return list(cand)
+    t0 = time.perf_counter()
+    qkey = " ".join(query.split())
+    scores: Dict[int, float] = {}
+    todo: List[int] = []
+    for cid, _ in cand:
+        hit = _score_cache.get((settings.RERANKER_MODEL, qkey, cid))
+        if hit is None:
+            todo.append(cid)
+        else:
+            scores[cid] = hit
+    budget = settings.RERANK_BUDGET_MS / 1000.0
+    batch = max(1, settings.RERANK_BATCH_SIZE)
+    scored = 0
+    try:
+        for s in range(0, len(todo), batch):
+            if budget and time.perf_counter() - t0 > budget:
+                elapsed = (time.perf_counter() - t0) * 1000
+                logger.warning("Rerank budget exceeded after %.1f ms (%d/%d pairs); using dense order", elapsed, scored, len(todo))
+                _bump(calls=1, pairs_scored=scored, budget_fallbacks=1, total_ms=elapsed)
+                return list(cand)
+            ids = todo[s : s + batch]
+            out = model.predict([(query, texts[cid]) for cid in ids], batch_size=batch, show_progress_bar=False)
+            for cid, sc in zip(ids, out):
+                scores[cid] = float(sc)
+                _score_cache.put((settings.RERANKER_MODEL, qkey, cid), float(sc))
+            scored += len(ids)
+    except Exception:
+        logger.exception("Rerank failed; using dense order")
+        _bump(calls=1, errors=1, total_ms=(time.perf_counter() - t0) * 1000)
+        return list(cand)
+    elapsed = (time.perf_counter() - t0) * 1000
+    logger.debug("Reranked %d candidates (%d scored, %d cached) in %.1f ms", len(cand), scored, len(cand) - scored, elapsed)
+    _bump(calls=1, pairs_scored=scored, total_ms=elapsed)
+    return sorted(((cid, scores[cid]) for cid, _ in cand), key=lambda x: x[1], reverse=True)
+
+
+def stats() -> Dict[str, Any]:
+    with _stats_lock:
+        out: Dict[str, Any] = dict(_stats)
+    out["total_ms"] = round(out["total_ms"], 1)
+    out["avg_ms"] = round(out["total_ms"] / out["calls"], 1) if out["calls"] else 0.0
+    out["enabled"] = enabled()
+    out["score_cache"] = _score_cache.stats()
+    return out
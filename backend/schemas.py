@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Any
+from typing import List, Literal, Optional, Any
 
 class ChatMessage(BaseModel):
     role: str
@@ -28,9 +28,25 @@ class Opportunity(BaseModel):
 class SearchRequest(BaseModel):
     query: str
     k: int = 5
+    mode: Optional[Literal["dense", "hybrid"]] = Field(default=None, description="Defaults to RETRIEVAL_MODE")
+    sources: Optional[List[str]] = Field(default=None, description='Restrict to Document.source values, e.g. "Notion"')
+    document_ids: Optional[List[int]] = None
+    mmr_lambda: Optional[float] = Field(default=None, ge=0.0, le=1.0, description="MMR relevance/diversity trade-off; 1 = no diversification")
 
 class SearchResult(BaseModel):
     document_title: str
     chunk_index: int
     score: float
     text: str
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=32)
+    k: int = 5
+    mode: Optional[Literal["dense", "hybrid"]] = None
+    sources: Optional[List[str]] = None
+    document_ids: Optional[List[int]] = None
+    mmr_lambda: Optional[float] = Field(default=None, ge=0.0, le=1.0)
+
+class BatchSearchResult(BaseModel):
+    query: str
+    results: List[SearchResult]
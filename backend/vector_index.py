@@ -0,0 +1,568 @@
+from __future__ import annotations
+import heapq
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from .config import settings
+from .db import Chunk, Document, legacy_embeddings, unpack_embedding
+from . import embedding_store, pgvector_search
+from .ann import build_ann
+from .quantization import Int8Quantizer
+
+
+def _normalize(m: np.ndarray) -> np.ndarray:
+    m = np.asarray(m, dtype=np.float32)
+    return m / (np.linalg.norm(m, axis=-1, keepdims=True) + 1e-9)
+
+
+def _shard_count() -> int:
+    return settings.SEARCH_SHARDS if settings.SEARCH_SHARDS > 0 else (os.cpu_count() or 1)
+
+
+_shard_pool: ThreadPoolExecutor | None = None
+_shard_pool_lock = threading.Lock()
+
+
+def _get_shard_pool() -> ThreadPoolExecutor:
+    global _shard_pool
+    if _shard_pool is None:
+        with _shard_pool_lock:
+            if _shard_pool is None:
+                _shard_pool = ThreadPoolExecutor(max_workers=_shard_count(), thread_name_prefix="vector-shard")
+    return _shard_pool
+
+
+def _shard_top_k(matrix: np.ndarray, ids: np.ndarray, start: int, end: int, Q: np.ndarray, k: int):
+    """Partial top-k of rows [start, end) per query, as (scores, global rows) sorted best first."""
+    scores = np.asarray(matrix[start:end]) @ Q.T
+    scores[ids[start:end] < 0] = -np.inf
+    kk = min(k, end - start)
+    top = np.argpartition(-scores, kk - 1, axis=0)[:kk]
+    top_scores = np.take_along_axis(scores, top, axis=0)
+    order = np.argsort(-top_scores, axis=0)
+    return np.take_along_axis(top_scores, order, axis=0), np.take_along_axis(top, order, axis=0) + start
+
+
+def sharded_top_k(
+    matrix: np.ndarray,
+    ids: np.ndarray,
+    size: int,
+    Q: np.ndarray,
+    k: int,
+    shards: int,
+    pool: ThreadPoolExecutor | None = None,
+) -> List[List[Tuple[int, float]]]:
+    """Exact top-k over `shards` contiguous row ranges scored in parallel threads (the
+    matrix products release the GIL), merged per query with a heap."""
+    bounds = np.linspace(0, size, shards + 1).astype(int)
+    parts = [(int(s), int(e)) for s, e in zip(bounds[:-1], bounds[1:]) if e > s]
+    pool = pool or _get_shard_pool()
+    futures = [pool.submit(_shard_top_k, matrix, ids, s, e, Q, k) for s, e in parts]
+    partial = [f.result() for f in futures]
+    out = []
+    for j in range(Q.shape[0]):
+        merged = heapq.merge(
+            *(zip((-sc[:, j]).tolist(), rows[:, j].tolist()) for sc, rows in partial)
+        )
+        hits = []
+        for neg, r in merged:
+            if len(hits) == k or neg == np.inf:
+                break
+            # a row tombstoned after the shard scans (remove_document) is skipped, as in _exact
+            if ids[r] >= 0:
+                hits.append((int(ids[r]), -neg))
+        out.append(hits)
+    return out
+
+
+class VectorIndex:
+    """Long-lived cosine index over chunk embeddings.
+
+    Rows are kept as normalized float32, either memory-mapped from the binary
+    embedding store or (store disabled) in a growable heap buffer. Replaced chunks are
+    tombstoned (chunk id -1) and compacted away once they make up a large share.
+    Readers work on a snapshot of the buffers, so writers only hold the lock for
+    the bookkeeping, never for the duration of a search.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._matrix: np.ndarray | None = None
+        self._chunk_ids = np.empty(0, dtype=np.int64)
+        self._doc_ids = np.empty(0, dtype=np.int64)
+        self._size = 0
+        self._dead = 0
+        self._loaded = False
+        self._checked_at = 0.0
+        self.generation = 0
+        # Row positions change only on full reloads and compaction; ANN structures are
+        # keyed on this layout counter and extended incrementally in between.
+        self._layout = 0
+        self._ann = None
+        self._ann_key: Tuple[int, str] | None = None
+        self._ann_building = False
+        # document -> source map, and per-generation filter structures built from it
+        self._doc_sources: Dict[int, str] = {}
+        self._source_bitmaps: Tuple[int, Dict[str, np.ndarray]] = (-1, {})
+        self._filter_cache: Dict[tuple, np.ndarray] = {}
+        # Optional int8 copy for the first-pass scan (VECTOR_QUANTIZATION=int8)
+        self._quant: Int8Quantizer | None = None
+        self._quant_layout = -1
+
+    def __len__(self) -> int:
+        return self._size - self._dead
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    # --- loading / syncing -------------------------------------------------
+
+    def load(self, db: Session, batch_size: int = 5000) -> None:
+        """(Re)build the index, mapping the binary embedding store when it is in sync with
+        the chunks table and falling back to (and backfilling from) the SQL embeddings."""
+        sources = {did: src or "" for did, src in db.query(Document.id, Document.source)}
+        with self._lock:
+            self._doc_sources = sources
+        store = embedding_store.get_store()
+        if store is not None:
+            count, max_id = db.query(func.count(Chunk.id), func.max(Chunk.id)).one()
+            if store.matches(int(count or 0), int(max_id or 0)):
+                self.map_store(store)
+                return
+            try:
+                # streamed batch by batch into the store files, then mapped
+                store.rewrite(self._scan(db, batch_size))
+                self.map_store(store)
+                return
+            except (OSError, TimeoutError):
+                pass
+        batches = list(self._scan(db, batch_size))
+        matrix = np.vstack([b[2] for b in batches]) if batches else None
+        ids = np.concatenate([b[0] for b in batches]) if batches else np.empty(0, dtype=np.int64)
+        docs = np.concatenate([b[1] for b in batches]) if batches else np.empty(0, dtype=np.int64)
+        with self._lock:
+            self._matrix = matrix
+            self._chunk_ids = ids
+            self._doc_ids = docs
+            self._size = len(ids)
+            self._dead = 0
+            self._layout += 1
+            self._refresh_quant()
+            self._loaded = True
+            self._checked_at = time.monotonic()
+            self.generation += 1
+
+    @staticmethod
+    def _scan(db: Session, batch_size: int) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """(chunk_ids, doc_ids, normalized vectors) per batch of `batch_size` chunks, in id order."""
+        q = select(Chunk.id, Chunk.document_id, Chunk.embedding_vec, Chunk.embedding_dim, Chunk.embedding_dtype).order_by(Chunk.id)
+        for batch in db.execute(q.execution_options(yield_per=batch_size)).partitions():
+            # rows not yet converted from the JSON column are fetched separately
+            legacy = legacy_embeddings(db, [cid for cid, _, blob, _, _ in batch if blob is None])
+            yield (
+                np.array([cid for cid, _, _, _, _ in batch], dtype=np.int64),
+                np.array([did if did is not None else -1 for _, did, _, _, _ in batch], dtype=np.int64),
+                _normalize(np.vstack([unpack_embedding(blob, dim, dtype, legacy.get(cid)) for cid, _, blob, dim, dtype in batch])),
+            )
+
+    def map_store(self, store: embedding_store.EmbeddingStore) -> None:
+        """Serve searches straight from the store's memmap (no copy of the vectors)."""
+        vectors, rows = store.open()
+        with self._lock:
+            old = self._chunk_ids[: self._size]
+            new = rows[: old.size, 0]
+            if rows.shape[0] < old.size or not np.all((new == old) | (new < 0)):
+                self._layout += 1
+            self._matrix = np.asarray(vectors) if vectors is not None else None
+            self._chunk_ids = rows[:, 0].copy()
+            self._doc_ids = rows[:, 1].copy()
+            self._size = int(rows.shape[0])
+            self._dead = int((self._chunk_ids < 0).sum())
+            self._refresh_quant()
+            self._loaded = True
+            self._checked_at = time.monotonic()
+            self.generation += 1
+
+    def sync(self, db: Session, force: bool = False) -> None:
+        """Reload when the table changed behind our back (e.g. CLI ETL in another process).
+
+        The check is a single COUNT/MAX aggregate, throttled by VECTOR_INDEX_SYNC_SECONDS.
+        """
+        if not self._loaded:
+            self.load(db)
+            return
+        now = time.monotonic()
+        if not force and now - self._checked_at < settings.VECTOR_INDEX_SYNC_SECONDS:
+            return
+        self._checked_at = now
+        count, max_id = db.query(func.count(Chunk.id), func.max(Chunk.id)).one()
+        if int(count or 0) != len(self) or int(max_id or 0) != self.max_chunk_id():
+            self.load(db)
+
+    def set_document_source(self, document_id: int, source: str | None) -> None:
+        with self._lock:
+            self._doc_sources[document_id] = source or ""
+            self.generation += 1
+
+    def bump_generation(self) -> None:
+        """Invalidate everything cached against the current generation."""
+        with self._lock:
+            self.generation += 1
+
+    def max_chunk_id(self) -> int:
+        _, ids, size, _ = self._snapshot()
+        return int(ids[:size].max()) if size else 0
+
+    def vectors(self, chunk_ids: Sequence[int]) -> np.ndarray:
+        """Normalized vectors for `chunk_ids`, in that order (zeros for unknown ids)."""
+        matrix, ids, size, _ = self._snapshot()
+        wanted = np.asarray(chunk_ids, dtype=np.int64)
+        out = np.zeros((wanted.size, matrix.shape[1] if matrix is not None else 0), dtype=np.float32)
+        if matrix is None or wanted.size == 0:
+            return out
+        rows = np.flatnonzero(np.isin(ids[:size], wanted))
+        pos = {int(cid): r for cid, r in zip(ids[rows].tolist(), rows.tolist())}
+        for i, cid in enumerate(wanted.tolist()):
+            r = pos.get(cid)
+            if r is not None:
+                out[i] = matrix[r]
+        return out
+
+    # --- incremental updates -----------------------------------------------
+
+    def remove_document(self, document_id: int) -> None:
+        with self._lock:
+            if self._size == 0:
+                return
+            rows = np.flatnonzero(self._doc_ids[: self._size] == document_id)
+            if rows.size == 0:
+                return
+            self._chunk_ids[rows] = -1
+            self._doc_ids[rows] = -1
+            self._dead += int(rows.size)
+            self.generation += 1
+            if self._dead > max(1024, self._size // 4):
+                self._compact()
+
+    def replace_document(self, document_id: int, chunk_ids: Sequence[int], embeddings: np.ndarray) -> None:
+        """Drop the document's previous rows and append its freshly written chunks."""
+        with self._lock:
+            self.remove_document(document_id)
+            if len(chunk_ids):
+                self._append(chunk_ids, [document_id] * len(chunk_ids), embeddings)
+                self._refresh_quant()
+            self.generation += 1
+
+    def _append(self, chunk_ids: Sequence[int], doc_ids: Sequence[int], embeddings: np.ndarray) -> None:
+        vecs = _normalize(np.atleast_2d(embeddings))
+        n = vecs.shape[0]
+        need = self._size + n
+        if self._matrix is None or need > self._matrix.shape[0] or vecs.shape[1] != self._matrix.shape[1]:
+            cap = max(need, 2 * self._size, 1024)
+            matrix = np.empty((cap, vecs.shape[1]), dtype=np.float32)
+            cids = np.full(cap, -1, dtype=np.int64)
+            dids = np.full(cap, -1, dtype=np.int64)
+            if self._matrix is not None and self._size:
+                matrix[: self._size] = self._matrix[: self._size]
+                cids[: self._size] = self._chunk_ids[: self._size]
+                dids[: self._size] = self._doc_ids[: self._size]
+            self._matrix, self._chunk_ids, self._doc_ids = matrix, cids, dids
+        self._matrix[self._size : need] = vecs
+        self._chunk_ids[self._size : need] = np.asarray(chunk_ids, dtype=np.int64)
+        self._doc_ids[self._size : need] = np.asarray(doc_ids, dtype=np.int64)
+        self._size = need
+
+    def _compact(self) -> None:
+        keep = np.flatnonzero(self._chunk_ids[: self._size] >= 0)
+        self._matrix = self._matrix[keep] if self._matrix is not None else None
+        self._chunk_ids = self._chunk_ids[keep]
+        self._doc_ids = self._doc_ids[keep]
+        self._size = int(keep.size)
+        self._dead = 0
+        self._layout += 1
+        self._refresh_quant()
+
+    def _refresh_quant(self) -> None:
+        """Keep the int8 codes in step with the rows: refit on layout changes, otherwise
+        only quantize appended rows. Caller holds the lock."""
+        if settings.VECTOR_QUANTIZATION != "int8" or self._matrix is None or self._size == 0:
+            self._quant = None
+            return
+        quant = self._quant
+        if quant is None or self._quant_layout != self._layout or quant.codes.shape[1] != self._matrix.shape[1]:
+            quant = Int8Quantizer()
+            quant.fit(self._matrix, self._size)
+            self._quant, self._quant_layout = quant, self._layout
+        else:
+            quant.extend(self._matrix, self._size)
+
+    # --- search ------------------------------------------------------------
+
+    def _snapshot(self) -> Tuple[np.ndarray | None, np.ndarray, int, int]:
+        with self._lock:
+            return self._matrix, self._chunk_ids, self._size, self._dead
+
+    def _current_ann(self, matrix: np.ndarray, size: int, mode: str):
+        """ANN structure for the current layout, extended with rows appended since it was
+        built; None (exact search) while a (re)build is still running in the background."""
+        with self._lock:
+            ann, key, layout = self._ann, self._ann_key, self._layout
+        if ann is None or key != (layout, mode):
+            self._schedule_ann_build(mode)
+            return None
+        if ann.ntotal < size:
+            with self._lock:
+                if ann.ntotal < size:
+                    ann.add(matrix[ann.ntotal : size])
+        return ann
+
+    def _schedule_ann_build(self, mode: str) -> None:
+        with self._lock:
+            if self._ann_building:
+                return
+            self._ann_building = True
+            matrix, size, layout = self._matrix, self._size, self._layout
+
+        def build() -> None:
+            try:
+                ann = build_ann(
+                    mode,
+                    matrix[:size],
+                    nlist=settings.ANN_NLIST,
+                    nprobe=settings.ANN_NPROBE,
+                    m=settings.HNSW_M,
+                    ef_search=settings.HNSW_EF_SEARCH,
+                    ef_construction=settings.HNSW_EF_CONSTRUCTION,
+                )
+                with self._lock:
+                    if layout == self._layout:
+                        self._ann, self._ann_key = ann, (layout, mode)
+            finally:
+                with self._lock:
+                    self._ann_building = False
+
+        threading.Thread(target=build, name="vector-index-ann", daemon=True).start()
+
+    def _ann_eligible(self, size: int, dead: int, exact: bool) -> bool:
+        return not exact and settings.VECTOR_SEARCH_MODE in ("ivf", "hnsw") and size - dead >= settings.ANN_MIN_ROWS
+
+    # --- filtering -----------------------------------------------------------
+
+    def _source_bitmap(self, docs: np.ndarray, size: int, generation: int, source: str) -> np.ndarray:
+        """Row bitmap for one source, built once per index generation."""
+        with self._lock:
+            gen, maps = self._source_bitmaps
+            if gen != generation:
+                maps = {}
+                self._source_bitmaps = (generation, maps)
+            bitmap = maps.get(source)
+            if bitmap is None:
+                wanted = np.fromiter(
+                    (d for d, src in self._doc_sources.items() if src == source), dtype=np.int64
+                )
+                bitmap = np.isin(docs[:size], wanted)
+                maps[source] = bitmap
+            return bitmap
+
+    def _filter_rows(
+        self,
+        docs: np.ndarray,
+        size: int,
+        generation: int,
+        sources: Optional[Iterable[str]],
+        document_ids: Optional[Iterable[int]],
+    ) -> np.ndarray | None:
+        """Row positions passing the source/document filter (None = no filter).
+
+        Sources are OR-ed together, as are document ids; both filters together intersect.
+        """
+        sources = frozenset(sources or ())
+        document_ids = frozenset(int(d) for d in (document_ids or ()))
+        if not sources and not document_ids:
+            return None
+        key = (generation, sources, document_ids)
+        rows = self._filter_cache.get(key)
+        if rows is not None:
+            return rows
+        mask = np.ones(size, dtype=bool)
+        if sources:
+            src_mask = np.zeros(size, dtype=bool)
+            for src in sources:
+                src_mask |= self._source_bitmap(docs, size, generation, src)
+            mask &= src_mask
+        if document_ids:
+            mask &= np.isin(docs[:size], np.fromiter(document_ids, dtype=np.int64))
+        rows = np.flatnonzero(mask)
+        with self._lock:
+            if len(self._filter_cache) > 256 or any(k[0] != generation for k in self._filter_cache):
+                self._filter_cache = {}
+            self._filter_cache[key] = rows
+        return rows
+
+    def documents_matching(self, sources: Optional[Iterable[str]] = None, document_ids: Optional[Iterable[int]] = None) -> np.ndarray | None:
+        """Document ids passing the filter (None = no filter); used to restrict other indexes."""
+        with self._lock:
+            docs, size, gen = self._doc_ids, self._size, self.generation
+        rows = self._filter_rows(docs, size, gen, sources, document_ids)
+        return None if rows is None else np.unique(docs[rows])
+
+    # --- search ------------------------------------------------------------
+
+    def search(
+        self,
+        query_vec: np.ndarray,
+        k: int,
+        exact: bool = False,
+        sources: Optional[Iterable[str]] = None,
+        document_ids: Optional[Iterable[int]] = None,
+    ) -> List[Tuple[int, float]]:
+        """Cosine top-k. Returns (chunk_id, score) pairs, best first.
+
+        Uses the ANN structure selected by VECTOR_SEARCH_MODE once the corpus has at least
+        ANN_MIN_ROWS live rows; falls back to the exact scan otherwise (or with exact=True).
+        With a source/document filter only the matching rows are scanned.
+        """
+        return self.search_batch(np.atleast_2d(query_vec), k, exact=exact, sources=sources, document_ids=document_ids)[0]
+
+    def search_batch(
+        self,
+        query_vecs: np.ndarray,
+        k: int,
+        exact: bool = False,
+        sources: Optional[Iterable[str]] = None,
+        document_ids: Optional[Iterable[int]] = None,
+    ) -> List[List[Tuple[int, float]]]:
+        """Top-k for several queries at once: one matrix-matrix product and a column-wise
+        argpartition instead of one scan per query."""
+        Q = _normalize(np.atleast_2d(query_vecs))
+        with self._lock:
+            matrix, ids, docs = self._matrix, self._chunk_ids, self._doc_ids
+            size, dead, gen = self._size, self._dead, self.generation
+            quant = self._quant if self._quant is not None and self._quant.size >= size else None
+        if matrix is None or size == 0 or k <= 0:
+            return [[] for _ in range(Q.shape[0])]
+        rows = self._filter_rows(docs, size, gen, sources, document_ids)
+        if rows is not None:
+            return self._exact(matrix, ids, rows, Q, k, quant=quant)
+        if self._ann_eligible(size, dead, exact):
+            ann = self._current_ann(matrix, size, settings.VECTOR_SEARCH_MODE)
+            if ann is not None:
+                out = []
+                for q in Q:
+                    found, scores = ann.search(matrix, q, k + min(dead, 4 * k), size=size)
+                    hits = [(int(ids[r]), float(sc)) for r, sc in zip(found, scores) if ids[r] >= 0]
+                    if len(hits) < min(k, size - dead):
+                        hits = self._exact(matrix, ids, None, q[None, :], k, size=size, dead=dead, quant=quant)[0]
+                    out.append(hits[:k])
+                return out
+        return self._exact(matrix, ids, None, Q, k, size=size, dead=dead, quant=quant)
+
+    @staticmethod
+    def _exact(
+        matrix: np.ndarray,
+        ids: np.ndarray,
+        rows: np.ndarray | None,
+        Q: np.ndarray,
+        k: int,
+        size: int = 0,
+        dead: int = 0,
+        quant: Int8Quantizer | None = None,
+    ) -> List[List[Tuple[int, float]]]:
+        """Brute-force top-k over all `size` rows, or only over `rows` when given.
+
+        With `quant`, the scan runs over the int8 codes and only the best
+        k * QUANT_RESCORE_FACTOR rows per query are rescored with the float vectors
+        (read from the memory-mapped store when it is enabled).
+        """
+        n = size if rows is None else rows.size
+        k = min(k, n - dead if rows is None else n)
+        if k <= 0:
+            return [[] for _ in range(Q.shape[0])]
+        if rows is None and quant is None:
+            shards = _shard_count()
+            if shards > 1 and size >= settings.SEARCH_SHARD_MIN_ROWS:
+                return sharded_top_k(matrix, ids, size, Q, k, shards)
+        if quant is not None:
+            scores = quant.scores(Q, size, rows)
+        else:
+            scores = (matrix[:size] if rows is None else matrix[rows]) @ Q.T  # (rows, queries)
+        if rows is None and dead:
+            scores[ids[:size] < 0] = -np.inf
+        if quant is not None:
+            r = min(n, max(k, k * settings.QUANT_RESCORE_FACTOR))
+            cand = np.argpartition(-scores, r - 1, axis=0)[:r]
+            out = []
+            for j in range(Q.shape[0]):
+                pos = np.sort(cand[:, j] if rows is None else rows[cand[:, j]])
+                pos = pos[ids[pos] >= 0]
+                exact = np.asarray(matrix[pos], dtype=np.float32) @ Q[j]
+                top = np.argsort(-exact)[:k]
+                out.append([(int(ids[pos[t]]), float(exact[t])) for t in top])
+            return out
+        top = np.argpartition(-scores, k - 1, axis=0)[:k]
+        top_scores = np.take_along_axis(scores, top, axis=0)
+        order = np.argsort(-top_scores, axis=0)
+        top = np.take_along_axis(top, order, axis=0)
+        top_scores = np.take_along_axis(top_scores, order, axis=0)
+        if rows is not None:
+            top = rows[top]
+        return [
+            [(int(ids[r]), float(sc)) for r, sc in zip(top[:, j], top_scores[:, j]) if ids[r] >= 0]
+            for j in range(Q.shape[0])
+        ]
+
+    def memory_stats(self) -> Dict[str, int]:
+        with self._lock:
+            matrix, size, quant = self._matrix, self._size, self._quant
+        return {
+            "rows": size,
+            "live_rows": len(self),
+            "float_bytes": int(matrix[:size].nbytes) if matrix is not None else 0,
+            "float_memory_mapped": isinstance(getattr(matrix, "base", None), np.memmap),
+            "int8_bytes": quant.nbytes if quant is not None else 0,
+        }
+
+
+_index = VectorIndex()
+
+
+def get_index() -> VectorIndex:
+    return _index
+
+
+def on_document_chunks_written(
+    document_id: int,
+    chunk_ids: Sequence[int],
+    embeddings: np.ndarray,
+    texts: Sequence[str] | None = None,
+    source: str | None = None,
+) -> None:
+    """Hook for writers: call after committing a document's replacement chunks.
+
+    Persists the vectors to the binary store (when enabled, outside pgvector mode)
+    and refreshes the in-process indexes (dense, and lexical when `texts` is given)
+    if this process serves searches. `source` keeps the index's source filter up to date.
+    """
+    if _index.loaded:
+        _index.set_document_source(document_id, source)
+    # with pgvector the dense search runs in SQL; nothing reads the file store
+    store = None if pgvector_search.enabled() else embedding_store.get_store()
+    if store is not None:
+        store.replace_document(document_id, chunk_ids, _normalize(np.atleast_2d(embeddings)))
+        if _index.loaded:
+            _index.map_store(store)
+    elif _index.loaded:
+        _index.replace_document(document_id, chunk_ids, embeddings)
+    else:
+        _index.bump_generation()
+    if texts is not None:
+        from . import lexical_index
+
+        lexical_index.on_document_chunks_written(document_id, chunk_ids, texts)
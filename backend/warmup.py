@@ -0,0 +1,92 @@
+from __future__ import annotations
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from . import ai_core, embedding_service, reranker
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_state: Dict[str, Dict[str, Any]] = {}
+
+
+def _warm_embedding() -> str:
+    embedding_service.embed_texts(["warmup"])
+    return embedding_service.model_id()
+
+
+def _warm_llm() -> str:
+    llm = ai_core.get_llm()
+    if llm is None:
+        raise RuntimeError(f"LLM not available ({settings.MODEL_GGUF_PATH})")
+    # one-token generation faults the weights in
+    llm("warmup", max_tokens=1)
+    return settings.MODEL_GGUF_PATH
+
+
+def _warm_reranker() -> str:
+    model = reranker.get_reranker()
+    if model is None:
+        raise RuntimeError(f"reranker not available ({settings.RERANKER_MODEL})")
+    model.predict([("warmup", "warmup")], show_progress_bar=False)
+    return settings.RERANKER_MODEL
+
+
+def _models() -> List[Tuple[str, Callable[[], str]]]:
+    models = [("embedding", _warm_embedding), ("llm", _warm_llm)]
+    if reranker.enabled():
+        models.append(("reranker", _warm_reranker))
+    return models
+
+
+def _set(name: str, **kw: Any) -> None:
+    with _lock:
+        _state.setdefault(name, {}).update(kw)
+
+
+def warm(name: str, fn: Callable[[], str]) -> None:
+    _set(name, status="loading", started_at=time.time(), error=None)
+    t0 = time.perf_counter()
+    try:
+        model = fn()
+    except Exception as e:
+        logger.warning("Warm-up of %s failed: %s", name, e)
+        _set(name, status="failed", error=str(e), seconds=round(time.perf_counter() - t0, 2))
+        return
+    _set(name, status="ready", model=model, seconds=round(time.perf_counter() - t0, 2))
+    logger.info("Warmed %s (%s) in %.1fs", name, model, time.perf_counter() - t0)
+
+
+def start() -> None:
+    """Warm every configured model in one background thread (startup must not block)."""
+    models = _models()
+    for name, _ in models:
+        _set(name, status="pending")
+
+    def run() -> None:
+        for name, fn in models:
+            warm(name, fn)
+
+    threading.Thread(target=run, name="model-warmup", daemon=True).start()
+
+
+def readiness() -> Tuple[bool, Dict[str, Any]]:
+    """(ready, per-model state). A failed required model is re-warmed on the next check
+    once MODEL_RETRY_SECONDS have passed, so a pod can recover without a restart."""
+    required = [m.strip() for m in settings.READY_REQUIRE.split(",") if m.strip()]
+    with _lock:
+        state = {name: dict(s) for name, s in _state.items()}
+    retry = dict(_models())
+    for name in required:
+        s = state.get(name)
+        if name not in retry:
+            continue
+        if s is None or (s["status"] == "failed" and time.time() - s["started_at"] >= settings.MODEL_RETRY_SECONDS):
+            _set(name, status="pending")
+            threading.Thread(target=warm, args=(name, retry[name]), name=f"model-warmup-{name}", daemon=True).start()
+            state[name] = {"status": "pending"}
+    ready = all(state.get(name, {}).get("status") == "ready" for name in required)
+    return ready, {"ready": ready, "required": required, "models": state}
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""Retrieval benchmarks against the exact (brute-force) search path.
+
+  python -m scripts.bench_retrieval ann --synthetic 200000
+  python -m scripts.bench_retrieval ann            # vectors from the embedding store / DB
+  python -m scripts.bench_retrieval quant --synthetic 200000
+  OPENBLAS_NUM_THREADS=1 python -m scripts.bench_retrieval shards --synthetic 1000000
+"""
+from __future__ import annotations
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
+import numpy as np
+
+from backend.ann import HNSWIndex, IVFIndex, auto_nlist, faiss_available
+from backend.quantization import Int8Quantizer
+from backend.vector_index import sharded_top_k
+
+
+def synthetic_corpus(n: int, dim: int, clusters: int = 256, seed: int = 0) -> np.ndarray:
+    """Clustered unit vectors; closer to real embedding geometry than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    x = centers[rng.integers(0, clusters, size=n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    return x / (np.linalg.norm(x, axis=1, keepdims=True) + 1e-9)
+
+
+def load_corpus() -> np.ndarray:
+    from backend.db import SessionLocal
+    from backend.vector_index import VectorIndex
+
+    index = VectorIndex()
+    db = SessionLocal()
+    try:
+        index.load(db)
+    finally:
+        db.close()
+    matrix, ids, size, _ = index._snapshot()
+    if matrix is None:
+        raise SystemExit("No chunks indexed yet; use --synthetic N")
+    return np.asarray(matrix[:size][ids[:size] >= 0])
+
+
+def sample_queries(matrix: np.ndarray, n: int, noise: float = 0.3, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    q = matrix[rng.integers(0, matrix.shape[0], size=n)] + noise * rng.standard_normal((n, matrix.shape[1])).astype(np.float32) / np.sqrt(matrix.shape[1])
+    return q / (np.linalg.norm(q, axis=1, keepdims=True) + 1e-9)
+
+
+def exact_top_k(matrix: np.ndarray, q: np.ndarray, k: int) -> np.ndarray:
+    scores = matrix @ q
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def measure(fn: Callable[[np.ndarray], np.ndarray], queries: np.ndarray, truth: List[np.ndarray], k: int) -> Tuple[float, float, float]:
+    """Return (recall@k, p50 ms, p95 ms)."""
+    lat: List[float] = []
+    hits = 0
+    for q, t in zip(queries, truth):
+        t0 = time.perf_counter()
+        got = fn(q)
+        lat.append((time.perf_counter() - t0) * 1000)
+        hits += len(np.intersect1d(got[:k], t))
+    return hits / (k * len(queries)), float(np.percentile(lat, 50)), float(np.percentile(lat, 95))
+
+
+def report_row(name: str, recall: float, p50: float, p95: float) -> None:
+    print(f"{name:<28} recall@k={recall:6.3f}  p50={p50:8.2f} ms  p95={p95:8.2f} ms")
+
+
+def cmd_ann(args) -> None:
+    matrix = synthetic_corpus(args.synthetic, args.dim) if args.synthetic else load_corpus()
+    queries = sample_queries(matrix, args.queries)
+    k = args.k
+    print(f"[INFO] corpus={matrix.shape[0]} dim={matrix.shape[1]} queries={len(queries)} k={k}")
+    truth = [exact_top_k(matrix, q, k) for q in queries]
+    report_row("exact", *measure(lambda q: exact_top_k(matrix, q, k), queries, truth, k))
+
+    nlist = args.nlist or auto_nlist(matrix.shape[0])
+    t0 = time.perf_counter()
+    ivf = IVFIndex(nlist=nlist, nprobe=1)
+    ivf.train(matrix)
+    ivf.add(matrix)
+    print(f"[INFO] ivf nlist={nlist} built in {time.perf_counter() - t0:.1f}s")
+    for nprobe in args.nprobe:
+        report_row(f"ivf nprobe={nprobe}", *measure(lambda q: ivf.search(matrix, q, k, nprobe=nprobe)[0], queries, truth, k))
+
+    if not faiss_available():
+        print("[INFO] faiss not installed; skipping hnsw")
+        return
+    t0 = time.perf_counter()
+    hnsw = HNSWIndex(matrix.shape[1], m=args.m, ef_search=args.ef_search[0], ef_construction=args.ef_construction)
+    hnsw.add(matrix)
+    print(f"[INFO] hnsw M={args.m} built in {time.perf_counter() - t0:.1f}s")
+    for ef in args.ef_search:
+        report_row(f"hnsw efSearch={ef}", *measure(lambda q: hnsw.search(matrix, q, k, ef_search=ef)[0], queries, truth, k))
+
+
+def cmd_quant(args) -> None:
+    matrix = synthetic_corpus(args.synthetic, args.dim) if args.synthetic else load_corpus()
+    queries = sample_queries(matrix, args.queries)
+    k = args.k
+    n = matrix.shape[0]
+    print(f"[INFO] corpus={n} dim={matrix.shape[1]} queries={len(queries)} k={k}")
+    truth = [exact_top_k(matrix, q, k) for q in queries]
+    report_row("float32 exact", *measure(lambda q: exact_top_k(matrix, q, k), queries, truth, k))
+
+    quant = Int8Quantizer()
+    t0 = time.perf_counter()
+    quant.fit(matrix, n)
+    print(f"[INFO] int8 codes built in {time.perf_counter() - t0:.1f}s: "
+          f"{quant.nbytes / 2**20:.1f} MiB vs float32 {matrix.nbytes / 2**20:.1f} MiB")
+
+    def int8_search(q: np.ndarray, factor: int) -> np.ndarray:
+        approx = quant.scores(q[None, :], n)[:, 0]
+        if factor == 0:
+            top = np.argpartition(-approx, k - 1)[:k]
+            return top[np.argsort(-approx[top])]
+        cand = np.sort(np.argpartition(-approx, k * factor - 1)[: k * factor])
+        exact = matrix[cand] @ q
+        return cand[np.argsort(-exact)[:k]]
+
+    report_row("int8 (no rescore)", *measure(lambda q: int8_search(q, 0), queries, truth, k))
+    for factor in args.rescore:
+        report_row(f"int8 + rescore x{factor}", *measure(lambda q: int8_search(q, factor), queries, truth, k))
+
+
+def cmd_shards(args) -> None:
+    matrix = synthetic_corpus(args.synthetic, args.dim) if args.synthetic else load_corpus()
+    queries = sample_queries(matrix, args.queries)
+    k = args.k
+    n = matrix.shape[0]
+    ids = np.arange(n, dtype=np.int64)
+    print(f"[INFO] corpus={n} dim={matrix.shape[1]} queries={len(queries)} k={k} cpus={os.cpu_count()}")
+    truth = [exact_top_k(matrix, q, k) for q in queries]
+    base = None
+    for shards in args.shards:
+        with ThreadPoolExecutor(max_workers=shards) as pool:
+            fn = lambda q: np.array([r for r, _ in sharded_top_k(matrix, ids, n, q[None, :], k, shards, pool)[0]])
+            recall, p50, p95 = measure(fn, queries, truth, k)
+        base = base or p50
+        report_row(f"shards={shards}", recall, p50, p95)
+        print(f"{'':<28} speedup x{base / p50:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval benchmarks (recall vs latency against exact search)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("ann", help="IVF/HNSW recall@k versus latency")
+    p.add_argument("--synthetic", type=int, default=0, help="Use N synthetic vectors instead of the indexed corpus")
+    p.add_argument("--dim", type=int, default=384, help="Dimension for --synthetic")
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--k", type=int, default=10)
+    p.add_argument("--nlist", type=int, default=0, help="IVF lists (0 = auto)")
+    p.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    p.add_argument("--m", type=int, default=32, help="HNSW M")
+    p.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128])
+    p.add_argument("--ef-construction", type=int, default=80)
+    p.set_defaults(func=cmd_ann)
+
+    p = sub.add_parser("quant", help="int8 first pass + float rescoring: recall@k, latency and memory")
+    p.add_argument("--synthetic", type=int, default=0, help="Use N synthetic vectors instead of the indexed corpus")
+    p.add_argument("--dim", type=int, default=384, help="Dimension for --synthetic")
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--k", type=int, default=10)
+    p.add_argument("--rescore", type=int, nargs="+", default=[1, 2, 4, 8], help="Rescore factors to try")
+    p.set_defaults(func=cmd_quant)
+
+    p = sub.add_parser("shards", help="Exact search latency versus shard (thread) count")
+    p.add_argument("--synthetic", type=int, default=0, help="Use N synthetic vectors instead of the indexed corpus")
+    p.add_argument("--dim", type=int, default=384, help="Dimension for --synthetic")
+    p.add_argument("--queries", type=int, default=100)
+    p.add_argument("--k", type=int, default=10)
+    p.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    p.set_defaults(func=cmd_shards)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
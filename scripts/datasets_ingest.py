@@ -4,9 +4,10 @@ import argparse
 import csv
 import os
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Iterator, List, Optional, Tuple
 
-from backend.db import get_session, Document, Chunk, create_all
+from backend.db import get_session, create_all
+from backend.chunk_writer import ChunkWriter
 from backend import embedding_service
 
 
@@ -33,21 +34,6 @@ def chunk_text(text: str, max_chars: int = 1000, overlap: int = 200) -> List[str
     return chunks
 
 
-def upsert_document(db, title: str, content: str, source: str, notion_page_id: Optional[str] = None) -> Document:
-    doc = None
-    if notion_page_id:
-        doc = db.query(Document).filter(Document.notion_page_id == notion_page_id).one_or_none()
-    if doc is None:
-        doc = db.query(Document).filter(Document.title == title, Document.source == source).one_or_none()
-    if doc is None:
-        doc = Document(title=title, content=content, source=source, notion_page_id=notion_page_id)
-        db.add(doc)
-        db.flush()
-    else:
-        doc.content = content
-    return doc
-
-
 def detect_text_columns(header: List[str]) -> List[str]:
     # Heuristic column names for text content
     candidates = {
@@ -127,41 +113,100 @@ def collect_files(root: Path, allowed_exts: set[str], max_files: Optional[int] =
     return files
 
 
-def ingest_file(db, path: Path, dataset_root: Path, max_chars: int, overlap: int):
+def file_documents(path: Path, dataset_root: Path, max_chars: int, overlap: int) -> Iterator[Tuple[str, str, str, List[str]]]:
+    """(title, content, source, pieces) for every document a dataset file yields."""
     rel = path.relative_to(dataset_root)
     source = f"Dataset|{rel.parts[0] if rel.parts else path.parent.name}"
     if path.suffix.lower() in TEXT_EXTS:
         content = path.read_text(encoding="utf-8", errors="ignore")
-        title = path.stem
         pieces = chunk_text(content, max_chars=max_chars, overlap=overlap)
-        if not pieces:
-            return 0
-        embs = embedding_service.embed_texts(pieces)
-        doc = upsert_document(db, title=title, content=content, source=source)
-        db.query(Chunk).filter(Chunk.document_id == doc.id).delete()
-        for idx, (txt, emb) in enumerate(zip(pieces, embs)):
-            db.add(Chunk(document_id=doc.id, chunk_index=idx, text=txt, embedding=emb.astype(float).tolist()))
-        db.commit()
-        return len(pieces)
+        if pieces:
+            yield path.stem, content, source, pieces
     elif path.suffix.lower() in CSV_EXTS:
         records = read_csv_records(path, limit_rows=2000)
-        total_chunks = 0
         for i, (title, content) in enumerate(records):
             pieces = chunk_text(content, max_chars=max_chars, overlap=overlap)
-            if not pieces:
-                continue
-            embs = embedding_service.embed_texts(pieces)
-            doc = upsert_document(db, title=f"{path.stem}:{title}", content=content, source=source)
-            db.query(Chunk).filter(Chunk.document_id == doc.id).delete()
-            for idx, (txt, emb) in enumerate(zip(pieces, embs)):
-                db.add(Chunk(document_id=doc.id, chunk_index=idx, text=txt, embedding=emb.astype(float).tolist()))
-            db.commit()
-            total_chunks += len(pieces)
+            if pieces:
+                yield f"{path.stem}:{title}", content, source, pieces
             # Safety: avoid flooding DB from huge CSVs
             if i >= 500:
                 break
-        return total_chunks
-    return 0
+
+
+def _write_documents(writer: ChunkWriter, items: List[Tuple[dict, List[str], object]], label: str) -> int:
+    """Upsert one file's documents and their chunks as a batch; returns the chunks written.
+    If the batch fails, documents are retried one by one so a bad one only drops itself."""
+    if not items:
+        return 0
+    try:
+        with writer.savepoint():
+            writer.write_documents(items)
+        written = sum(len(pieces) for _, pieces, _ in items)
+    except Exception:
+        written = 0
+        for item in items:
+            try:
+                with writer.savepoint():
+                    writer.write_documents([item])
+            except Exception as e:
+                print(f"  ! Error ingesting {label} ({item[0]['title']}): {e}")
+                continue
+            written += len(item[1])
+    writer.checkpoint()
+    return written
+
+
+def ingest_file(db, path: Path, dataset_root: Path, max_chars: int, overlap: int, writer: Optional[ChunkWriter] = None):
+    own = writer is None
+    writer = writer or ChunkWriter(db)
+    docs = (
+        (({"title": title, "content": content, "source": source}, pieces), pieces)
+        for title, content, source, pieces in file_documents(path, dataset_root, max_chars, overlap)
+    )
+    # coalesced: a CSV's one-chunk rows are encoded together, not one call per row
+    items = [(fields, pieces, embs) for (fields, pieces), embs in embedding_service.embed_documents_iter(docs)]
+    total_chunks = _write_documents(writer, items, str(path))
+    if own:
+        writer.commit()
+    return total_chunks
+
+
+def ingest_files_parallel(
+    db, files: List[Path], dataset_root: Path, max_chars: int, overlap: int, workers: int, writer: Optional[ChunkWriter] = None
+) -> int:
+    """Like calling ingest_file per file, but documents from consecutive files are
+    embedded together (by `workers` processes when > 1) while earlier ones are written."""
+    own = writer is None
+    writer = writer or ChunkWriter(db)
+
+    def pending():
+        for p in files:
+            try:
+                for title, content, source, pieces in file_documents(p, dataset_root, max_chars, overlap):
+                    yield (p, {"title": title, "content": content, "source": source}, pieces), pieces
+            except Exception as e:
+                print(f"  ! Error ingesting {p}: {e}")
+
+    total_chunks = 0
+    current, items = None, []
+
+    def flush() -> int:
+        c = _write_documents(writer, items, str(current))
+        print(f"  + {current.relative_to(dataset_root)} -> {c} chunks")
+        items.clear()
+        return c
+
+    for (p, fields, pieces), embs in embedding_service.embed_documents_iter(pending(), workers=workers):
+        if p != current:
+            if current is not None:
+                total_chunks += flush()
+            current = p
+        items.append((fields, pieces, embs))
+    if current is not None:
+        total_chunks += flush()
+    if own:
+        writer.commit()
+    return total_chunks
 
 
 def main():
@@ -172,6 +217,7 @@ def main():
     parser.add_argument("--max-mb", type=float, default=2.0, help="Max file size in MB")
     parser.add_argument("--max-chars", type=int, default=1000, help="Chunk size in chars")
     parser.add_argument("--overlap", type=int, default=200, help="Chunk overlap in chars")
+    parser.add_argument("--workers", type=int, default=1, help="Embedding worker processes (1 = embed in this process)")
     args = parser.parse_args()
 
     dataset_root = Path(args.root).resolve()
@@ -189,15 +235,17 @@ def main():
     try:
         files = collect_files(dataset_root, allowed_exts, max_files=args.limit, max_mb=args.max_mb)
         print(f"[INFO] Found {len(files)} candidate files for ingestion")
-        total_chunks = 0
-        for p in files:
-            try:
-                c = ingest_file(db, p, dataset_root, max_chars=args.max_chars, overlap=args.overlap)
-                print(f"  + {p.relative_to(dataset_root)} -> {c} chunks")
-                total_chunks += c
-            except Exception as e:
-                print(f"  ! Error ingesting {p}: {e}")
+        writer = ChunkWriter(db)
+        # one stream for every worker count, so small documents are encoded in batches
+        total_chunks = ingest_files_parallel(
+            db, files, dataset_root, max_chars=args.max_chars, overlap=args.overlap, workers=args.workers, writer=writer
+        )
+        writer.commit()
         print(f"[DONE] Total chunks ingested: {total_chunks}")
+        print(f"[INFO] Chunk writes: {writer.summary()}")
+        cache = embedding_service.document_cache_stats()
+        if cache:
+            print(f"[INFO] Embedding cache: {cache['hits']} hits, {cache['misses']} misses")
     finally:
         try:
             next(gen)
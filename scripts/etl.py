@@ -1,9 +1,9 @@
 from __future__ import annotations
 import argparse
 from typing import List
-from sqlalchemy.orm import Session
 from datetime import datetime
-from backend.db import get_session, Document, Chunk, create_all
+from backend.db import get_session, Document, create_all
+from backend.chunk_writer import ChunkWriter
 from backend.notion_service import NotionService
 from backend import embedding_service
 import numpy as np
@@ -26,24 +26,7 @@ def chunk_text(text: str, max_chars: int = 1000, overlap: int = 200) -> List[str
     return [" ".join(c.split()) for c in chunks if c.strip()]
 
 
-def upsert_document(db: Session, title: str, content: str, notion_page_id: str | None = None, source: str | None = None) -> Document:
-    # naive: match by title or notion_page_id
-    doc = None
-    if notion_page_id:
-        doc = db.query(Document).filter(Document.notion_page_id == notion_page_id).one_or_none()
-    if doc is None:
-        doc = db.query(Document).filter(Document.title == title).one_or_none()
-    if doc is None:
-        doc = Document(title=title, content=content, notion_page_id=notion_page_id, source=source)
-        db.add(doc)
-        db.flush()
-    else:
-        doc.content = content
-        doc.source = source
-    return doc
-
-
-def run_refresh(categories: List[str] | None = None, incremental: bool = False):
+def run_refresh(categories: List[str] | None = None, incremental: bool = False, workers: int = 1):
     create_all()
     svc = NotionService()
     # Acquire a session explicitly
@@ -58,35 +41,55 @@ def run_refresh(categories: List[str] | None = None, incremental: bool = False):
         else:
             docs = svc.list_documents(include_content=True)
 
-        for d in docs:
-            title = d.get("title", "Untitled")
-            content = d.get("content", "")
-            page_id = d.get("id")
-            last_edited = d.get("last_edited_time")
+        # incremental: one lookup for every page's stored content instead of one per page
+        known = {}
+        if incremental:
+            page_ids = [d["id"] for d in docs if d.get("id")]
+            for s in range(0, len(page_ids), 500):
+                q = db.query(Document.notion_page_id, Document.content).filter(Document.notion_page_id.in_(page_ids[s : s + 500]))
+                known.update(q.all())
+
+        def pending():
+            for d in docs:
+                title = d.get("title", "Untitled")
+                content = d.get("content", "")
+                page_id = d.get("id")
 
-            # incremental: skip if doc exists and not modified (simple heuristic via content length or timestamp)
-            if incremental and page_id:
-                existing = db.query(Document).filter(Document.notion_page_id == page_id).one_or_none()
-                if existing and existing.content == content:
-                    # unchanged content, skip
+                # incremental: skip if doc exists and its content is unchanged
+                if incremental and page_id and known.get(page_id) == content:
                     continue
 
-            # chunk
-            pieces = chunk_text(content)
-            if not pieces:
-                continue
-            # embed
-            embs = embedding_service.embed_texts(pieces).astype(float)
-            # upsert doc
-            doc = upsert_document(db, title=title, content=content, notion_page_id=page_id, source="Notion")
-            # clear old chunks
-            db.query(Chunk).filter(Chunk.document_id == doc.id).delete()
-            # insert new
-            for idx, (txt, emb) in enumerate(zip(pieces, embs)):
-                ch = Chunk(document_id=doc.id, chunk_index=idx, text=txt, embedding=emb.tolist())
-                db.add(ch)
-            db.commit()
-            print(f"Indexed: {title} -> {len(pieces)} chunks")
+                # chunk
+                pieces = chunk_text(content)
+                if not pieces:
+                    continue
+                fields = {"title": title, "content": content, "notion_page_id": page_id, "source": "Notion"}
+                yield (fields, pieces), pieces
+
+        writer = ChunkWriter(db)
+        batch, batch_rows = [], 0
+
+        def flush():
+            # upsert the batch's documents and swap in their chunks in one transaction
+            writer.write_documents(batch)
+            writer.commit()
+            for fields, pieces, _ in batch:
+                print(f"Indexed: {fields['title']} -> {len(pieces)} chunks")
+            batch.clear()
+
+        # embed (cache first; with workers > 1 several documents are encoded in parallel)
+        for (fields, pieces), embs in embedding_service.embed_documents_iter(pending(), workers=workers):
+            batch.append((fields, pieces, embs))
+            batch_rows += len(pieces)
+            if batch_rows >= writer.batch_rows:
+                flush()
+                batch_rows = 0
+        if batch:
+            flush()
+        print(f"Chunk writes: {writer.summary()}")
+        cache = embedding_service.document_cache_stats()
+        if cache:
+            print(f"Embedding cache: {cache['hits']} hits, {cache['misses']} misses")
     finally:
         try:
             next(gen)
@@ -99,9 +102,10 @@ def main():
     parser.add_argument("--refresh", action="store_true", help="Full refresh of all docs")
     parser.add_argument("--incremental", action="store_true", help="Enable incremental refresh (skip unchanged)")
     parser.add_argument("--category", action="append", help="Filter category (can repeat)")
+    parser.add_argument("--workers", type=int, default=1, help="Embedding worker processes (1 = embed in this process)")
     args = parser.parse_args()
     if args.refresh:
-        run_refresh(categories=args.category, incremental=args.incremental)
+        run_refresh(categories=args.category, incremental=args.incremental, workers=args.workers)
     else:
         print("No action. Use --refresh")
 
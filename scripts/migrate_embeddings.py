@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""Convert legacy JSON chunk embeddings to the packed float32 column.
+
+Works in short id-ordered batches (one small transaction each), so readers and
+writers keep running; rows that already have `embedding_vec` are skipped, which
+makes the command safe to interrupt and re-run.
+
+  python -m scripts.migrate_embeddings
+  python -m scripts.migrate_embeddings --batch-size 2000 --clear-json
+  (on a SQLite table created with a NOT NULL JSON column, --clear-json rebuilds the
+  table in batches, since SQLite cannot relax the constraint in place)
+  PGVECTOR=1 python -m scripts.migrate_embeddings --pgvector   # also fill chunks.embedding_pgv
+"""
+from __future__ import annotations
+import argparse
+import time
+from sqlalchemy import bindparam, null, select, text, update
+
+from backend import db as dbmod
+from backend.db import Chunk, SessionLocal, create_all, pack_embedding, pgvector_literal, unpack_embedding
+
+
+def migrate(batch_size: int = 1000, clear_json: bool = False, pause: float = 0.0) -> int:
+    create_all()  # adds the packed columns to an existing chunks table
+    # a SQLite table from before the binary column still has NOT NULL on the JSON
+    # column: convert first, then rebuild the table without it (which clears the JSON)
+    rebuild = clear_json and dbmod.LEGACY_JSON_REQUIRED
+    if rebuild:
+        clear_json = False
+    table = Chunk.__table__
+    stmt = (
+        update(table)
+        .where(table.c.id == bindparam("cid"))
+        .values(
+            embedding_vec=bindparam("embedding_vec"),
+            embedding_dim=bindparam("embedding_dim"),
+            embedding_dtype=bindparam("embedding_dtype"),
+            **({"embedding": null()} if clear_json else {}),
+        )
+    )
+    done = 0
+    last_id = 0
+    t0 = time.perf_counter()
+    while True:
+        session = SessionLocal()
+        try:
+            rows = session.execute(
+                select(table.c.id, table.c.embedding)
+                .where(table.c.embedding_vec.is_(None), table.c.id > last_id)
+                .order_by(table.c.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            params = []
+            for cid, emb in rows:
+                if emb is None:
+                    continue
+                fields = pack_embedding(emb)
+                fields.pop("embedding", None)
+                params.append({"cid": cid, **fields})
+            if params:
+                session.execute(stmt, params)
+            session.commit()
+        finally:
+            session.close()
+        last_id = rows[-1][0]
+        done += len(params)
+        print(f"[INFO] converted {done} rows (last id {last_id}, {done / (time.perf_counter() - t0):.0f} rows/s)")
+        if pause:
+            time.sleep(pause)
+    if rebuild:
+        copied = rebuild_sqlite_chunks(batch_size, pause)
+        print(f"[INFO] rebuilt chunks with a nullable JSON column ({copied} rows, legacy JSON cleared); restart the API")
+    elif clear_json:
+        cleared = _clear_json(batch_size)
+        print(f"[INFO] cleared legacy JSON on {cleared} rows")
+    return done
+
+
+def rebuild_sqlite_chunks(batch_size: int = 1000, pause: float = 0.0) -> int:
+    """Recreate a SQLite chunks table whose JSON column is NOT NULL (SQLite cannot alter
+    that in place). Rows are copied into chunks_new in short id-ordered transactions,
+    with the JSON kept only for rows that still lack the packed vector; the last step
+    (catch-up of rows written meanwhile, swap, index re-creation) runs in one write
+    transaction."""
+    from sqlalchemy import MetaData
+    from sqlalchemy.schema import CreateTable
+
+    engine = dbmod.engine
+    cols = [c.name for c in Chunk.__table__.columns if c.name != "embedding"]
+    names = ", ".join(cols + ["embedding"])
+    values = ", ".join(cols + ["CASE WHEN embedding_vec IS NULL THEN embedding END"])
+    copy_stmt = text(
+        f"INSERT INTO chunks_new ({names}) SELECT {values} FROM chunks WHERE id > :last ORDER BY id LIMIT :n"
+    )
+    meta = MetaData()
+    dbmod.Document.__table__.to_metadata(meta)  # FK target
+    new_table = Chunk.__table__.to_metadata(meta, name="chunks_new")
+    with engine.begin() as conn:
+        indexes = conn.execute(
+            text("SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'chunks' AND sql IS NOT NULL")
+        ).scalars().all()
+        conn.execute(text("DROP TABLE IF EXISTS chunks_new"))
+        conn.execute(CreateTable(new_table))
+    copied = 0
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            n = conn.execute(copy_stmt, {"last": last_id, "n": batch_size}).rowcount
+            if not n:
+                break
+            last_id = conn.execute(text("SELECT MAX(id) FROM chunks_new")).scalar()
+        copied += n
+        print(f"[INFO] rebuild: copied {copied} rows (last id {last_id})")
+        if pause:
+            time.sleep(pause)
+    with engine.begin() as conn:
+        # writers replace chunks by delete + insert, so catching up is: drop what was
+        # deleted, copy what was added
+        conn.execute(text("DELETE FROM chunks_new WHERE id NOT IN (SELECT id FROM chunks)"))
+        copied += conn.execute(
+            text(f"INSERT INTO chunks_new ({names}) SELECT {values} FROM chunks WHERE id > :last"), {"last": last_id}
+        ).rowcount
+        conn.execute(text("DROP TABLE chunks"))
+        conn.execute(text("ALTER TABLE chunks_new RENAME TO chunks"))
+        for sql in indexes:
+            conn.execute(text(sql))
+    dbmod.ensure_embedding_columns()
+    return copied
+
+
+def _clear_json(batch_size: int) -> int:
+    table = Chunk.__table__
+    cleared = 0
+    while True:
+        session = SessionLocal()
+        try:
+            ids = session.execute(
+                select(table.c.id)
+                .where(table.c.embedding_vec.is_not(None), table.c.embedding.is_not(None))
+                .limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                return cleared
+            session.execute(update(table).where(table.c.id.in_(ids)).values(embedding=null()))
+            session.commit()
+            cleared += len(ids)
+        finally:
+            session.close()
+
+
+def fill_pgvector(batch_size: int = 1000, pause: float = 0.0) -> int:
+    """Copy vectors into chunks.embedding_pgv for rows written before PGVECTOR was on."""
+    if not dbmod.USE_PGVECTOR:
+        raise SystemExit("--pgvector needs a Postgres DATABASE_URL and PGVECTOR=1")
+    create_all()  # extension, column and index
+    select_stmt = text(
+        "SELECT id, embedding_vec, embedding_dim, embedding_dtype, embedding FROM chunks "
+        "WHERE embedding_pgv IS NULL AND id > :last ORDER BY id LIMIT :n"
+    )
+    update_stmt = text("UPDATE chunks SET embedding_pgv = CAST(:v AS vector) WHERE id = :cid")
+    done = 0
+    last_id = 0
+    while True:
+        session = SessionLocal()
+        try:
+            rows = session.execute(select_stmt, {"last": last_id, "n": batch_size}).all()
+            if not rows:
+                break
+            params = [
+                {"cid": cid, "v": pgvector_literal(unpack_embedding(blob, dim, dtype, legacy))}
+                for cid, blob, dim, dtype, legacy in rows
+                if blob is not None or legacy is not None
+            ]
+            if params:
+                session.execute(update_stmt, params)
+            session.commit()
+        finally:
+            session.close()
+        last_id = rows[-1][0]
+        done += len(params)
+        print(f"[INFO] pgvector: filled {done} rows (last id {last_id})")
+        if pause:
+            time.sleep(pause)
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate chunk embeddings from JSON to packed float32")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Rows per transaction")
+    parser.add_argument(
+        "--clear-json", action="store_true",
+        help="Also NULL the legacy JSON column once converted (rebuilds old SQLite tables where it is NOT NULL)",
+    )
+    parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches")
+    parser.add_argument("--pgvector", action="store_true", help="Also fill the pgvector column (PGVECTOR=1, Postgres)")
+    args = parser.parse_args()
+    n = migrate(batch_size=args.batch_size, clear_json=args.clear_json, pause=args.pause)
+    print(f"[DONE] {n} rows converted")
+    if args.pgvector:
+        n = fill_pgvector(batch_size=args.batch_size, pause=args.pause)
+        print(f"[DONE] {n} rows copied to embedding_pgv")
+
+
+if __name__ == "__main__":
+    main()